@@ -1,49 +1,86 @@
-import base64
+import argparse
+import json
+import multiprocessing
 import os
-from io import BytesIO
+import threading
+from functools import lru_cache
 
 import numpy as np
 import plotly.graph_objects as go
 from dash import Dash, dcc, html
-from dash.dependencies import Input, Output
-from PIL import Image
-from sklearn.neighbors import KernelDensity
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
+import metrics
+from density import (
+    ENGINE, GRID_SIZE, density_grid, difference_grid, precompute
+)
+from distances import BINS, distance_distribution, field_goal_pct
+from games import conferences, game_shots
 from player_data import player_data
+from store import (
+    LEAGUE, available_seasons, season_dir, season_label, store_version
+)
 from utils import teams_east, teams_west, players_dict, teams_dict
+from zones import zone_distribution, zone_grid, zone_labels, zones
 
 app = Dash(__name__)
 app.title = "Visualizing NBA Shooting"
+metrics.install(app.server)
 
 W = 500*1.2
 H = 472*1.2
-HALFCOURT_LEN = 47
-
-halfcourt = "nbahalfcourt.png"
-
-
-image = Image.open(halfcourt)
-buffered = BytesIO()
-image.save(buffered, format="PNG")
-img_str = base64.b64encode(buffered.getvalue()).decode()
+SEASONS = available_seasons()
+SCATTERGL_MIN_POINTS = 5000
+DEFAULT_COLORSCALE = "Portland"
+DIFFERENCE_COLORSCALE = "RdBu_r"
+
+# Density charts are first sent on a coarse grid and then refined. Grids
+# are quantised to Z_BITS wide integers, 8 or 16.
+PREVIEW_GRID_SIZE = 50
+Z_BITS = 8
+
+# Zone charts color every zone by its FG%, or by the difference in FG% when
+# comparing, within these ranges
+ZONE_GRID_SIZE = 100
+ZONE_FG_RANGE = (0.25, 0.7)
+ZONE_DIFFERENCE_RANGE = 0.15
+
+# Served from assets/ so browsers fetch and cache it once instead of
+# receiving it inlined as base64 in every figure
+halfcourt = app.get_asset_url("nbahalfcourt.png")
 
 types = ["made", "missed", "all"]
 shot_type_dict = {"Made": "made", "Missed": "missed", "Attempted": "all"}
+dist_stats = {"made": "made", "missed": "miss", "all": "all"}
+dist_labels = {"made": "made", "miss": "missed", "all": "attempted"}
 
 
-chart_types = ["points", "density"]
+chart_types = ["points", "density", "zones"]
 
 
-def plot_team_shot_chart(team, chart_type, shot_type, colorscale):
+def plot_team_shot_chart(team, chart_type, shot_type, colorscale, season,
+                         compare=None, last=None, opponent=None,
+                         grid_size=GRID_SIZE):
     if shot_type not in types:
         raise ValueError(
             f"{shot_type} is not a valid input. Possible choices: {types}"
         )
 
     if chart_type.lower() == "density":
-        return create_heatmap(team, shot_type, colorscale=colorscale)
+        return create_heatmap(
+            team, shot_type, colorscale=colorscale, season=season,
+            compare=compare, last=last, opponent=opponent,
+            grid_size=grid_size
+        )
     elif chart_type.lower() == "points":
-        return create_scatter(team, shot_type)
+        return create_scatter(
+            team, shot_type, season=season, last=last, opponent=opponent
+        )
+    elif chart_type.lower() == "zones":
+        return create_zone_chart(
+            team, season, compare=compare, last=last, opponent=opponent
+        )
     else:
         raise ValueError(
             f"{chart_type} is not a valid input. "
@@ -51,54 +88,94 @@ def plot_team_shot_chart(team, chart_type, shot_type, colorscale):
         )
 
 
-def create_heatmap(team, shot_type, colorscale):
-    path = f"data/{team}"
+def load_shots(team, shot_type, season, last=None, opponent=None):
+    with metrics.timer("heatshot_stage_seconds", stage="load"):
+        shots = game_shots(
+            season, team, shot_type, last=last, opponent=opponent
+        )
+    return shots["x"], shots["y"]
 
-    x = np.array([])
-    y = np.array([])
-    with os.scandir(path) as it:
-        for entry in it:
-            if entry.name.endswith(".npz") and entry.is_file():
-                if not entry.name.startswith("dists"):
-                    if entry.name.startswith(shot_type) or shot_type == "all":
-                        data = np.load(f"{path}/{entry.name}")
-                        x = np.append(x, data["arr_0"])
-                        y = np.append(y, data["arr_1"])
 
-    data = np.vstack([x, y]).T
+def create_heatmap(team, shot_type, colorscale, season, engine=ENGINE,
+                   compare=None, last=None, opponent=None,
+                   grid_size=GRID_SIZE):
+    window = dict(
+        engine=engine, last=last, opponent=opponent, grid_size=grid_size
+    )
+    if compare:
+        Z = difference_grid(season, team, compare, shot_type, **window)
+    else:
+        Z = density_grid(season, team, shot_type, **window)
 
-    kde = KernelDensity(bandwidth=30, kernel='epanechnikov')
-    kde.fit(data)
+    with metrics.timer("heatshot_stage_seconds", stage="figure"):
+        return heatmap_figure(Z, colorscale, difference=bool(compare))
 
-    xmin, xmax = np.min(x), np.max(x)
-    ymin, ymax = np.min(y), np.max(y)
 
-    xmin, xmax = -10, 485
-    ymin, ymax = -15, 440
+def quantise(Z, signed=False, bits=Z_BITS):
+    # Maps Z linearly onto the integers of a bits wide type, so the grid is
+    # sent as small integers instead of full floats. Returns the value of
+    # one step along with it.
+    levels = 2 ** (bits - signed) - 1
+    peak = float(np.abs(Z).max()) if Z.size else 0
+    step = peak / levels if peak > 0 else 1
+    dtype = f"{'i' if signed else 'u'}{bits // 8}"
 
-    x_grid = np.linspace(xmin, xmax, 200)
-    y_grid = np.linspace(ymin, ymax, 200)
-    X, Y = np.meshgrid(x_grid, y_grid)
-    positions = np.vstack([X.ravel(), Y.ravel()]).T
+    return np.rint(Z / step).astype(dtype), step, levels
 
-    Z = np.exp(kde.score_samples(positions)).reshape(X.shape)
 
+def colorbar_ticks(step, low, high, n=5):
+    tickvals = np.linspace(low, high, n)
+    return dict(
+        tickvals=tickvals.tolist(),
+        ticktext=[f"{value * step:.2g}" for value in tickvals]
+    )
+
+
+def heatmap_figure(Z, colorscale, difference=False):
     fig = go.Figure()
-    fig.add_trace(
-        go.Heatmap(
-            z=np.sqrt(Z),
-            opacity=1,
-            colorbar=dict(
-                title="Square Root of Kernel Density Estimate",
-                x=1,
-                xanchor="left")
+
+    # Cells are stretched over the same axes whatever the grid size
+    cell = dict(x0=0, dx=200 / Z.shape[1], y0=0, dy=200 / Z.shape[0])
+
+    if difference:
+        # Red where the entity shoots more often than the one compared to,
+        # blue where it shoots less often
+        z, step, levels = quantise(np.sign(Z) * np.sqrt(np.abs(Z)), True)
+        fig.add_trace(
+            go.Heatmap(
+                z=z,
+                **cell,
+                opacity=1,
+                zmin=-levels,
+                zmax=levels,
+                meta="difference",
+                colorscale=DIFFERENCE_COLORSCALE,
+                colorbar=dict(
+                    title="Signed Square Root of Density Difference",
+                    x=1,
+                    xanchor="left",
+                    **colorbar_ticks(step, -levels, levels))
+            )
+        )
+    else:
+        z, step, levels = quantise(np.sqrt(Z))
+        fig.add_trace(
+            go.Heatmap(
+                z=z,
+                **cell,
+                opacity=1,
+                zmin=0,
+                zmax=levels,
+                colorscale=colorscale,
+                colorbar=dict(
+                    title="Square Root of Kernel Density Estimate",
+                    x=1,
+                    xanchor="left",
+                    **colorbar_ticks(step, 0, levels))
+            )
         )
-    )
 
-    fig.update_traces(
-        colorbar_title_side="right",
-        colorscale=colorscale
-    )
+    fig.update_traces(colorbar_title_side="right")
 
     fig.update_layout(xaxis_range=[0, 200])
     fig.update_layout(yaxis_range=[0, 200])
@@ -108,7 +185,7 @@ def create_heatmap(team, shot_type, colorscale):
         height=H+10,
         images=[
             dict(
-                source='data:image/png;base64,{}'.format(img_str),
+                source=halfcourt,
                 xref="paper",
                 yref="paper",
                 x=0, y=1,
@@ -128,33 +205,34 @@ def create_heatmap(team, shot_type, colorscale):
     return fig
 
 
-def create_scatter(team, shot_type):
-    path = f"data/{team}"
+def create_scatter(team, shot_type, season, last=None, opponent=None):
+    xs, ys = load_shots(team, shot_type, season, last, opponent)
+
+    with metrics.timer("heatshot_stage_seconds", stage="figure"):
+        return scatter_figure(xs, ys)
 
-    x = np.array([])
-    y = np.array([])
-    with os.scandir(path) as it:
-        for entry in it:
-            if entry.name.endswith(".npz") and entry.is_file():
-                if entry.name.startswith(shot_type) or shot_type == "all":
-                    data = np.load(f"{path}/{entry.name}")
-                    x = np.append(x, data["arr_0"])
-                    y = np.append(y, data["arr_1"])
 
-    def normalize(value, min_value, max_value, new_min, new_max):
-        return ((value - min_value) / (max_value - min_value)) * (new_max - new_min) + new_min
+def scatter_figure(xs, ys):
+    def normalize(values, new_min, new_max):
+        # A window without games has no shots
+        if not len(values):
+            return values
+        min_value, max_value = values.min(), values.max()
+        scale = (new_max - new_min) / max(max_value - min_value, 1)
+        return (values - min_value) * scale + new_min
 
-    xs = x
-    ys = y
-    x_min, x_max = min(xs), max(xs)
-    y_min, y_max = min(ys), max(ys)
+    normalized_x = normalize(xs, 0, W)
+    normalized_y = normalize(ys, 0, H)
 
-    normalized_x = [normalize(x, x_min, x_max, 0, W) for x in xs]
-    normalized_y = [normalize(y, y_min, y_max, 0, H) for y in ys]
+    # SVG rendering slows down noticeably beyond a few thousand markers
+    if len(xs) > SCATTERGL_MIN_POINTS:
+        trace = go.Scattergl
+    else:
+        trace = go.Scatter
 
     fig = go.Figure()
     fig.add_trace(
-        go.Scatter(x=normalized_x, y=normalized_y, mode="markers")
+        trace(x=normalized_x, y=normalized_y, mode="markers")
     )
 
     fig.update_layout(xaxis_range=[0, W+10])
@@ -165,7 +243,7 @@ def create_scatter(team, shot_type):
         height=H+20,
         images=[
             dict(
-                source='data:image/png;base64,{}'.format(img_str),
+                source=halfcourt,
                 xref="paper",
                 yref="paper",
                 x=0, y=1,
@@ -190,6 +268,137 @@ def create_scatter(team, shot_type):
     return fig
 
 
+def create_zone_chart(team, season, compare=None, last=None,
+                      opponent=None):
+    # FG% needs made and missed shots, so the shot type does not apply
+    counts = zone_distribution(season, team, last=last, opponent=opponent)
+    other = None
+    if compare:
+        other = zone_distribution(
+            season, compare, last=last, opponent=opponent
+        )
+
+    with metrics.timer("heatshot_stage_seconds", stage="figure"):
+        return zone_figure(counts, other)
+
+
+def zone_figure(counts, other=None):
+    grid = zone_grid(ZONE_GRID_SIZE)
+    cell = dict(x0=0, dx=200 / grid.shape[1], y0=0, dy=200 / grid.shape[0])
+
+    attempts = counts.sum(axis=0)
+    pct = np.where(attempts > 0, field_goal_pct(counts), np.nan)
+    if other is not None:
+        other_pct = np.where(
+            other.sum(axis=0) > 0, field_goal_pct(other), np.nan
+        )
+        value = pct - other_pct
+        trace = dict(
+            zmin=-ZONE_DIFFERENCE_RANGE,
+            zmax=ZONE_DIFFERENCE_RANGE,
+            meta="difference",
+            colorscale=DIFFERENCE_COLORSCALE,
+            colorbar=dict(title="FG% Difference", tickformat="+.0%"),
+        )
+    else:
+        value = pct
+        trace = dict(
+            zmin=ZONE_FG_RANGE[0],
+            zmax=ZONE_FG_RANGE[1],
+            colorscale=DEFAULT_COLORSCALE,
+            colorbar=dict(title="FG%", tickformat=".0%"),
+        )
+
+    # The grid only holds the zone of every cell, the figure looks up the
+    # value of each zone. Zones without attempts stay blank.
+    fig = go.Figure()
+    fig.add_trace(
+        go.Heatmap(
+            z=value.astype(np.float32)[grid],
+            **cell,
+            opacity=0.8,
+            hoverinfo="skip",
+            **trace
+        )
+    )
+    fig.update_traces(
+        colorbar_x=1, colorbar_xanchor="left", colorbar_title_side="right"
+    )
+
+    rows, cols = np.indices(grid.shape)
+    for i, zone in enumerate(zones):
+        inside = grid == i
+        if not inside.any():
+            continue
+
+        text = f"<b>{zone_labels[zone]}</b><br>"
+        if attempts[i]:
+            text += f"{pct[i]:.1%} ({counts[0, i]}/{attempts[i]})"
+        else:
+            text += "no attempts"
+        if other is not None and not np.isnan(value[i]):
+            text += f"<br>{value[i]:+.1%}"
+
+        fig.add_annotation(
+            x=cols[inside].mean() * cell["dx"],
+            y=rows[inside].mean() * cell["dy"],
+            text=text,
+            showarrow=False,
+            font=dict(size=10),
+            bgcolor="rgba(255, 255, 255, 0.7)",
+        )
+
+    fig.update_layout(xaxis_range=[0, 200])
+    fig.update_layout(yaxis_range=[0, 200])
+
+    fig.update_layout(
+        width=W,
+        height=H+10,
+        images=[
+            dict(
+                source=halfcourt,
+                xref="paper",
+                yref="paper",
+                x=0, y=1,
+                sizex=1, sizey=1,
+                xanchor="left", yanchor="top",
+                sizing="stretch",
+                layer="above",
+            )
+        ]
+    )
+
+    fig['layout']['yaxis']['autorange'] = "reversed"
+
+    fig.update_xaxes(showgrid=False, zeroline=False, showticklabels=False)
+    fig.update_yaxes(showgrid=False, zeroline=False, showticklabels=False)
+
+    return fig
+
+
+def entity_options(category):
+    if category == "Team":
+        return [{"label": "League Average", "value": LEAGUE}] + [
+            {"label": teams_dict[team], "value": team}
+            for team in teams_east + teams_west
+        ]
+    else:
+        return [{"label": "League Average", "value": LEAGUE}] + [
+            {"label": players_dict[player], "value": player}
+            for player in players_dict
+        ]
+
+
+def opponent_options():
+    return [
+        {"label": f"vs. {conference}ern Conference", "value": conference}
+        for conference in conferences
+    ] + [
+        {"label": f"vs. {teams_dict[team]}", "value": team}
+        for team in teams_east + teams_west
+    ]
+
+
 app.layout = html.Div([
     html.H2(
         children="Visualizing NBA shooting tendencies",
@@ -215,6 +424,25 @@ app.layout = html.Div([
                     style={"margin-top": "75px", 'padding': '20px'}
                 ),
 
+                html.Div(
+                    [
+                        html.B("Season", style={"vertical-align": "top"}),
+                        dcc.Dropdown(
+                            id="season",
+                            options=[
+                                {
+                                    "label": season_label(season),
+                                    "value": season
+                                }
+                                for season in SEASONS
+                            ],
+                            value=SEASONS[0],
+                            clearable=False,
+                        ),
+                    ],
+                    style={'padding': '0px 20px', "width": "120px"}
+                ),
+
                 html.Img(
                     id="img",
                     src="",
@@ -263,7 +491,7 @@ app.layout = html.Div([
                                 ),
                                 dcc.RadioItems(
                                     ["Portland", "Jet", "Hot"],
-                                    "Portland",
+                                    DEFAULT_COLORSCALE,
                                     id="colorscale",
                                 ),
                             ],
@@ -272,6 +500,24 @@ app.layout = html.Div([
                                 "margin-left": "100px",
                             }
                         ),
+
+                        html.Div(
+                            [
+                                html.B(
+                                    "Chart Type",
+                                    style={"vertical-align": "top"}
+                                ),
+                                dcc.RadioItems(
+                                    ["Density", "Points", "Zones"],
+                                    "Density",
+                                    id="shot-chart-type",
+                                ),
+                            ],
+                            style={
+                                "display": "inline-block",
+                                "margin-left": "100px",
+                            }
+                        ),
                     ],
                     style={
                         "margin-top": "75px",
@@ -283,10 +529,7 @@ app.layout = html.Div([
                 html.Div(
                     dcc.Dropdown(
                         id="dropdown",
-                        options=[
-                            {"label": teams_dict[team], "value": team}
-                            for team in teams_east + teams_west
-                        ],
+                        options=entity_options("Team"),
                         value="BOS",
                     ),
                     style={
@@ -298,6 +541,46 @@ app.layout = html.Div([
                     }
                 ),
 
+                html.Div(
+                    dcc.Dropdown(
+                        id="compare",
+                        options=entity_options("Team"),
+                        placeholder="Compare to...",
+                    ),
+                    style={
+                        "margin-left": "60px",
+                        "margin-top": "0px",
+                        "margin-bottom": "0px",
+                        'padding': '0px 10px 10px 10px',
+                        "width": "75%"
+                    }
+                ),
+
+                html.Div(
+                    [
+                        dcc.Dropdown(
+                            id="games",
+                            options=[
+                                {"label": f"Last {n} games", "value": n}
+                                for n in [5, 10, 20]
+                            ],
+                            placeholder="All games",
+                            style={"width": "200px"}
+                        ),
+                        dcc.Dropdown(
+                            id="opponent",
+                            options=opponent_options(),
+                            placeholder="Any opponent",
+                            style={"width": "200px", "margin-left": "10px"}
+                        ),
+                    ],
+                    style={
+                        "display": "flex",
+                        "margin-left": "60px",
+                        'padding': '0px 10px 10px 10px',
+                    }
+                ),
+
                 html.P(
                     id="player-desc",
                     style={
@@ -332,6 +615,12 @@ app.layout = html.Div([
             style={"flex": "1", "margin-left": "0px", "margin-right": "100px"}
         ),
 
+        # Shot chart as computed by the server, before the color scale
+        # selected in the browser is applied to it. Density charts arrive
+        # as a coarse preview first and are refined afterwards.
+        dcc.Store(id="shot-chart-preview"),
+        dcc.Store(id="shot-chart-base"),
+
     ],
              style={
              "margin-top": "10px",
@@ -350,8 +639,11 @@ app.layout = html.Div([
     Input("category", "value"),
     Input("dropdown", "value")
 )
+@metrics.instrument
 def update_player_desc(category, dropdown):
-    if category == "Player":
+    if dropdown == LEAGUE:
+        return ""
+    elif category == "Player":
         # TODO: Make this dynamic
         attributes = ["Position", "Shoots", "Height", "Weight"]
         description = []
@@ -372,8 +664,11 @@ def update_player_desc(category, dropdown):
     Input("category", "value"),
     Input("dropdown", "value")
 )
+@metrics.instrument
 def update_image(category, dropdown):
-    if category == "Player":
+    if dropdown == LEAGUE:
+        return ""
+    elif category == "Player":
         return f"assets/{dropdown}.jpg"
     else:
         return f"assets/{dropdown}.png"
@@ -382,80 +677,154 @@ def update_image(category, dropdown):
 @app.callback(
     Output("dropdown", "options"),
     Output("dropdown", "value"),
+    Output("compare", "options"),
+    Output("compare", "value"),
+    Output("games", "disabled"),
+    Output("games", "value"),
+    Output("opponent", "disabled"),
+    Output("opponent", "value"),
     Input("category", "value")
 )
+@metrics.instrument
 def update_dropdown(category):
     if category == "Team":
-        options = [
-            {"label": teams_dict[team], "value": team}
-            for team in teams_east + teams_west
-        ]
         value = "BOS"
     elif category == "Player":
-        options = [
-            {"label": players_dict[player], "value": player}
-            for player in players_dict
-        ]
         value = "curryst01"
 
-    return options, value
+    # Player shots come from the season pages and are not tied to games
+    no_games = category == "Player"
+
+    options = entity_options(category)
+    return options, value, options, None, no_games, None, no_games, None
+
+
+shot_chart_inputs = [
+    ("dropdown", "value"),
+    ("shot-type", "value"),
+    ("shot-chart-type", "value"),
+    ("season", "value"),
+    ("compare", "value"),
+    ("games", "value"),
+    ("opponent", "value"),
+]
+
+
+def shot_chart(grid_size, team, shot_type, chart_type, season, compare=None,
+               last=None, opponent=None):
+    shot_type = shot_type_dict[shot_type]
+    metrics.inc("heatshot_cache_lookups_total", cache="figure")
+    figure = shot_chart_json(
+        team, shot_type, chart_type, season, compare, last, opponent,
+        store_version(season), grid_size
+    )
+
+    # The inputs tag the figure, so the browser only shows a refined chart
+    # if it belongs to the preview on display
+    key = json.dumps(
+        [team, shot_type, chart_type, season, compare, last, opponent]
+    )
+    return {**figure, "layout": {**figure["layout"], "meta": key}}
 
 
 @app.callback(
-    Output("shot-chart", "figure"),
-    Input("dropdown", "value"),
-    Input("shot-type", "value"),
-    Input("colorscale", "value"),
-    # Input("shot-chart-type", "value")
+    Output("shot-chart-preview", "data"),
+    *[Input(*prop) for prop in shot_chart_inputs]
 )
-def plot_heatmap(team, shot_type, colorscale, chart_type="density"):
+@metrics.instrument
+def plot_heatmap(team, shot_type, chart_type, season, compare=None,
+                 last=None, opponent=None):
+    # Density charts come on a coarse grid first, points are final already
+    grid_size = (
+        PREVIEW_GRID_SIZE if chart_type.lower() == "density" else GRID_SIZE
+    )
+    return shot_chart(
+        grid_size, team, shot_type, chart_type, season, compare, last,
+        opponent
+    )
 
-    shot_type = shot_type_dict[shot_type]
-    return plot_team_shot_chart(
+
+@app.callback(
+    Output("shot-chart-base", "data"),
+    Input("shot-chart-preview", "data"),
+    *[State(*prop) for prop in shot_chart_inputs]
+)
+@metrics.instrument
+def refine_heatmap(preview, team, shot_type, chart_type, season,
+                   compare=None, last=None, opponent=None):
+    if chart_type.lower() != "density":
+        raise PreventUpdate
+
+    return shot_chart(
+        GRID_SIZE, team, shot_type, chart_type, season, compare, last,
+        opponent
+    )
+
+
+# Figures are cached already converted to JSON types, so repeated requests
+# skip building and validating the figure and converting its arrays
+@lru_cache(maxsize=512)
+def shot_chart_json(team, shot_type, chart_type, season, compare, last,
+                    opponent, version, grid_size=GRID_SIZE):
+    metrics.inc("heatshot_cache_misses_total", cache="figure")
+    fig = plot_team_shot_chart(
         team,
         chart_type=chart_type,
         shot_type=shot_type,
-        colorscale=colorscale
+        colorscale=DEFAULT_COLORSCALE,
+        season=season,
+        compare=compare,
+        last=last,
+        opponent=opponent,
+        grid_size=grid_size
     )
+    with metrics.timer("heatshot_stage_seconds", stage="serialize"):
+        return json.loads(fig.to_json())
 
 
-def plot_dists(dropdown, category, stat="made"):
+# The color scale does not change the density, so switching it only
+# restyles the heatmap in the browser without a request to the server
+app.clientside_callback(
+    """
+    function(preview, refined, colorscale) {
+        if (!preview) {
+            return window.dash_clientside.no_update;
+        }
+        const figure = refined && refined.layout.meta === preview.layout.meta
+            ? refined
+            : preview;
+        const data = figure.data.map(
+            trace => trace.type === "heatmap" && trace.meta !== "difference"
+                ? {...trace, colorscale: colorscale}
+                : trace
+        );
+        return {...figure, data: data};
+    }
+    """,
+    Output("shot-chart", "figure"),
+    Input("shot-chart-preview", "data"),
+    Input("shot-chart-base", "data"),
+    Input("colorscale", "value")
+)
 
-    data_made = np.load(f"data/{dropdown}/dists.npz")
-    data_missed = np.load(f"data/{dropdown}/dists_missed.npz")
 
-    xs_made, ys_made = data_made["arr_1"], data_made["arr_0"]
-    xs_missed, ys_missed = data_missed["arr_1"], data_missed["arr_0"]
+def plot_dists(dropdown, category, season, stat="made", last=None,
+               opponent=None):
 
-    if stat == "fgp":
-        made_shape = xs_made.shape[0]
-        missed_shape = xs_missed.shape[0]
-
-        pad_made_len = HALFCOURT_LEN - made_shape
-        pad_missed_len = HALFCOURT_LEN - missed_shape
-
-        for i in range(0, pad_made_len):
-            xs_made = np.append(xs_made, max(xs_made)+i)
-            ys_made = np.append(ys_made, 0)
-        for i in range(0, pad_missed_len):
-            xs_missed = np.append(xs_missed, max(xs_made)+i)
-            ys_missed = np.append(ys_missed, 0)
-
-        zero_mask = (ys_made == 0) & (ys_missed == 0)
-        ys_pct = np.divide(
-            ys_made, ys_missed + ys_made,
-            out=np.zeros_like(ys_made, dtype=float),
-            where=(ys_missed + ys_made) != 0
-        )
+    counts = distance_distribution(
+        season, dropdown, last=last, opponent=opponent
+    )
+    xs = np.arange(BINS)
+    ys_made, ys_missed = counts
 
-        ys_pct[zero_mask] = 0
-        ys = ys_pct
+    if stat == "fgp":
+        ys = field_goal_pct(counts)
     elif stat == "made":
         ys = ys_made
     elif stat == "miss":
         ys = ys_missed
     elif stat == "all":
-        ys = np.append(ys_made, ys_missed)
+        ys = ys_made + ys_missed
 
     layout = go.Layout(
         margin=dict(t=20),
@@ -464,12 +833,16 @@ def plot_dists(dropdown, category, stat="made"):
 
     fig = go.Figure(layout=layout)
 
-    hover_text = [
-        f"{y} shots made from {x} ft" for (x, y) in zip(xs_made, ys_made)
-    ]
+    if stat == "fgp":
+        hover_text = [f"{y:.1%} FG from {x} ft" for (x, y) in zip(xs, ys)]
+    else:
+        hover_text = [
+            f"{y} shots {dist_labels[stat]} from {x} ft"
+            for (x, y) in zip(xs, ys)
+        ]
     fig.add_trace(
         go.Scatter(
-            x=xs_made,
+            x=xs,
             y=ys,
             mode='lines',
             name='Line Chart',
@@ -480,7 +853,8 @@ def plot_dists(dropdown, category, stat="made"):
 
     fig.update_layout(
         xaxis_title="Shot distance (ft)",
-        yaxis_title="No. of made shots"
+        yaxis_title="FG%" if stat == "fgp"
+        else f"No. of {dist_labels[stat]} shots"
     )
 
     annotation_y = max(ys) // 2
@@ -504,10 +878,84 @@ def plot_dists(dropdown, category, stat="made"):
     Output("shot-dists", "style"),
     Input("category", "value"),
     Input("dropdown", "value"),
+    Input("season", "value"),
+    Input("shot-type", "value"),
+    Input("games", "value"),
+    Input("opponent", "value"),
 )
-def create_dist_graph(category, dropdown):
-    return plot_dists(dropdown, category), {"display": "block"}
+@metrics.instrument
+def create_dist_graph(category, dropdown, season, shot_type="Made",
+                      last=None, opponent=None):
+    stat = dist_stats[shot_type_dict[shot_type]]
+    fig = plot_dists(
+        dropdown, category, season, stat, last=last, opponent=opponent
+    )
+    return fig, {"display": "block"}
+
+
+def precompute_once(season):
+    # The pool is spawned, forking this process while its server threads
+    # run can deadlock the children. Workers of a deployment precompute one
+    # after the other, so only the first computes the grids and the others
+    # find them on disk. Without fcntl, e.g. on Windows, every process
+    # precomputes for itself.
+    spawn = multiprocessing.get_context("spawn")
+    try:
+        import fcntl
+    except ImportError:
+        precompute(season, mp_context=spawn)
+        return
+
+    os.makedirs(season_dir(season), exist_ok=True)
+    with open(f"{season_dir(season)}/warm-up.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        precompute(season, mp_context=spawn)
+
+
+def warm_up(season=SEASONS[0]):
+    # Fills the density cache on disk in worker processes, then the figure
+    # cache of this process with the default view of every team and player.
+    # Callbacks that come first simply compute what they need themselves.
+    precompute_once(season)
+
+    version = store_version(season)
+    entities = teams_east + teams_west + list(players_dict) + [LEAGUE]
+    for entity in entities:
+        for grid_size in [PREVIEW_GRID_SIZE, GRID_SIZE]:
+            shot_chart_json(
+                entity, "all", "Density", season, None, None, None, version,
+                grid_size
+            )
+    print(f"Warmed up {len(entities)} shot charts of {season}")
+
+
+def start_warm_up():
+    threading.Thread(target=warm_up, daemon=True).start()
+
+
+# Servers that import app.server, e.g. gunicorn with several workers, warm
+# up every worker on startup when HEATSHOT_WARM_UP=1 is set. The spawned
+# precompute processes import this module as well and must not.
+if (
+    __name__ != "__main__"
+    and multiprocessing.parent_process() is None
+    and os.environ.get("HEATSHOT_WARM_UP") == "1"
+):
+    start_warm_up()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the Dash app")
+    parser.add_argument("--no-warm-up", action="store_true")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record timings and serve them on /metrics")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable()
+
+    # With debug the reloader runs this module twice, only the child serves
+    if not args.no_warm_up and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_warm_up()
+
     app.run(debug=True)
@@ -0,0 +1,326 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from sklearn.neighbors import KernelDensity
+
+import store
+from density import (
+    FIXED_BANDWIDTH, GRID_SIZE, KERNEL, bin_shots, compute_bandwidth,
+    density_from_counts, grid_positions
+)
+from distances import (
+    _distance_distribution, distance_counts, distance_distribution
+)
+from games import build_games
+from scrape import parse_shots
+from zones import team_zone_counts, zone_counts
+
+# Synthetic datasets repeat the shots of the bundled entity with some
+# jitter. sklearn scores every grid point against every nearby shot, so it
+# is skipped beyond this many shots unless asked for.
+SCALES = [1, 10, 100]
+SKLEARN_MAX_SHOTS = 100_000
+JITTER = 5
+REPEAT = 5
+FIXTURE_SHOTS = 2000
+
+# Saved pages in the markup of the site, with both charts of a box score,
+# nested divs and a player chart inside a comment
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "tests", "fixtures")
+fixture_pages = [
+    ("parse_boxscore", "boxscore_202310250NYK.html", "match", "BOS"),
+    ("parse_player", "player_tatumja01_2024.html", "player", ""),
+]
+
+
+def measure(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def result(name, times, scale=1, n=None, size=None):
+    median = statistics.median(times)
+    entry = {
+        "benchmark": name,
+        "scale": scale,
+        "n": n,
+        "repeat": len(times),
+        "min": min(times),
+        "median": median,
+        "mean": statistics.mean(times),
+        "times": times,
+    }
+    if n is not None and median > 0:
+        entry["items_per_s"] = n / median
+    if size is not None:
+        entry["bytes"] = size
+        if median > 0:
+            entry["mb_per_s"] = size / 1e6 / median
+
+    print(
+        f"{name:>18} x{scale:<4} median {median * 1e3:10.3f} ms"
+        f"  min {min(times) * 1e3:10.3f} ms"
+        + (f"  n={n}" if n is not None else ""),
+        file=sys.stderr
+    )
+    return entry
+
+
+def scaled_shots(shots, scale, seed=0):
+    if scale == 1:
+        return np.array(shots)
+
+    rng = np.random.default_rng(seed)
+    scaled = np.tile(np.array(shots), scale)
+    for name in ["x", "y"]:
+        scaled[name] += rng.integers(
+            -JITTER, JITTER + 1, len(scaled)
+        ).astype(scaled[name].dtype)
+
+    return scaled
+
+
+def bench_shots(shots, scale, repeat, with_sklearn):
+    # Stages that only depend on the shot arrays, on a temporary store
+    results = []
+    n = len(shots)
+
+    data_dir = store.data_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        store.data_dir = tmp
+        season = "bench"
+        try:
+            results.append(result("store_write", measure(
+                lambda: store.write_store(shots, season), repeat
+            ), scale, n))
+            results.append(result("store_load", measure(
+                lambda: store.open_store(season), repeat,
+                setup=lambda: store._stores.pop(season, None)
+            ), scale, n))
+
+            stored, index = store.open_store(season)
+            results.append(result("games_index", measure(
+                lambda: build_games(stored, index), repeat
+            ), scale, n))
+            results.append(result("season_zones", measure(
+                lambda: team_zone_counts(stored, index), repeat
+            ), scale, n))
+        finally:
+            store._stores.pop(season, None)
+            store.data_dir = data_dir
+
+    x, y = shots["x"], shots["y"]
+    results.append(result("bin_shots", measure(
+        lambda: bin_shots(x, y, GRID_SIZE), repeat
+    ), scale, n))
+
+    counts = bin_shots(x, y, GRID_SIZE)
+    results.append(result("fft_density", measure(
+        lambda: density_from_counts(
+            counts, n, KERNEL, FIXED_BANDWIDTH, GRID_SIZE
+        ),
+        repeat
+    ), scale, n))
+
+    for method in ["scott", "cv"]:
+        results.append(result(f"bandwidth_{method}", measure(
+            lambda: compute_bandwidth(counts, n, KERNEL, method, GRID_SIZE),
+            repeat
+        ), scale, n))
+
+    results.append(result("distance_counts", measure(
+        lambda: distance_counts(shots), repeat
+    ), scale, n))
+    results.append(result("zone_counts", measure(
+        lambda: zone_counts(shots), repeat
+    ), scale, n))
+
+    if with_sklearn or n <= SKLEARN_MAX_SHOTS:
+        data = np.vstack([x, y]).T
+        kde = KernelDensity(bandwidth=FIXED_BANDWIDTH, kernel=KERNEL)
+        results.append(result("kde_fit", measure(
+            lambda: kde.fit(data), repeat
+        ), scale, n))
+
+        positions = grid_positions(GRID_SIZE)
+        results.append(result("kde_score", measure(
+            lambda: kde.score_samples(positions), min(repeat, 3)
+        ), scale, n))
+
+    return results
+
+
+def bench_app(season, entity, repeat):
+    # Figure construction and serialisation of the app with a warm density
+    # cache, so the timings do not include the KDE
+    import app
+
+    results = []
+    app.density_grid(season, entity, "all")
+
+    fig = app.create_heatmap(entity, "all", app.DEFAULT_COLORSCALE, season)
+    results.append(result("heatmap_figure", measure(
+        lambda: app.create_heatmap(
+            entity, "all", app.DEFAULT_COLORSCALE, season
+        ),
+        repeat
+    )))
+    results.append(result("heatmap_json", measure(
+        lambda: fig.to_json(), repeat
+    ), size=len(fig.to_json())))
+
+    fig = app.create_scatter(entity, "all", season)
+    results.append(result("scatter_figure", measure(
+        lambda: app.create_scatter(entity, "all", season), repeat
+    )))
+    results.append(result("scatter_json", measure(
+        lambda: fig.to_json(), repeat
+    ), size=len(fig.to_json())))
+
+    results.append(result("zones_figure", measure(
+        lambda: app.create_zone_chart(entity, season), repeat
+    )))
+
+    results.append(result("dists_query", measure(
+        lambda: distance_distribution(season, entity), repeat,
+        setup=_distance_distribution.cache_clear
+    )))
+    fig = app.plot_dists(entity, "Team", season, "fgp")
+    results.append(result("dists_figure", measure(
+        lambda: app.plot_dists(entity, "Team", season, "fgp"), repeat
+    )))
+    results.append(result("dists_json", measure(
+        lambda: fig.to_json(), repeat
+    ), size=len(fig.to_json())))
+
+    return results
+
+
+def fixture_html(n, team="ATL", seed=0):
+    # A box score with one shot chart in the markup of Basketball-Reference
+    rng = random.Random(seed)
+    tips = []
+    for _ in range(n):
+        made = rng.random() < 0.45
+        x, y = rng.randint(-8, 485), rng.randint(-12, 368)
+        verb = "made" if made else "missed"
+        tip = (
+            "1st quarter, 11:43.0 remaining<br>"
+            f"Trae Young {verb} 3-pointer from {rng.randint(0, 40)} ft<br>"
+            f"{team} leads 3-0"
+        )
+        tips.append(
+            f'<div style="top:{y}px;left:{x}px;" tip="{tip}" '
+            f'class="tooltip {"make" if made else "miss"}">&#9679;</div>'
+        )
+
+    return (
+        '<html><body><div class="shot-area">'
+        f'<div id="shots-{team}">{"".join(tips)}</div>'
+        "</div></body></html>"
+    )
+
+
+def bench_parser(repeat, n=FIXTURE_SHOTS):
+    html = fixture_html(n)
+    results = [result("parse_match", measure(
+        lambda: parse_shots(html, "match", team="ATL", match_id="0"),
+        repeat
+    ), n=n, size=len(html.encode()))]
+
+    for name, page, category, team in fixture_pages:
+        with open(os.path.join(FIXTURE_DIR, page), encoding="utf-8") as f:
+            html = f.read()
+        shots = parse_shots(html, category, team=team)
+        results.append(result(name, measure(
+            lambda: parse_shots(html, category, team=team), repeat
+        ), n=len(shots), size=len(html.encode())))
+
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {
+            (entry["benchmark"], entry["scale"]): entry
+            for entry in json.load(f)["results"]
+        }
+
+    print(f"\nCompared to {baseline_path} (median, >1 is slower)",
+          file=sys.stderr)
+    for entry in results:
+        old = baseline.get((entry["benchmark"], entry["scale"]))
+        if old is None or not old["median"]:
+            continue
+        ratio = entry["median"] / old["median"]
+        print(f"{entry['benchmark']:>18} x{entry['scale']:<4} {ratio:6.2f}",
+              file=sys.stderr)
+
+
+def run(season, entity, scales, repeat, with_sklearn):
+    shots = store.select_shots(season, entity)
+
+    results = []
+    for scale in scales:
+        results += bench_shots(
+            scaled_shots(shots, scale), scale, repeat, with_sklearn
+        )
+    results += bench_app(season, entity, repeat)
+    results += bench_parser(repeat)
+
+    return {
+        "meta": {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "season": season,
+            "entity": entity,
+            "shots": len(shots),
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the load, density and render hot paths"
+    )
+    parser.add_argument("--season", default=store.legacy_season)
+    parser.add_argument("--entity", default="GSW")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--sklearn", action="store_true",
+                        help="also run sklearn on the large datasets")
+    parser.add_argument("--output", help="write the results as JSON here")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    report = run(
+        args.season, args.entity, args.scales, args.repeat, args.sklearn
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+
+    if args.compare:
+        compare(report["results"], args.compare)
@@ -0,0 +1,598 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache, partial
+
+import numpy as np
+from sklearn.neighbors import KernelDensity
+
+import metrics
+from games import common_windows, game_shots, window_tag
+from store import (
+    LEAGUE, box_score_y, season_dir, select_shots, store_version
+)
+from utils import teams_east, teams_west, players
+
+# Extent of the shot chart in pixels the density is evaluated on
+XMIN, XMAX = -10, 485
+YMIN, YMAX = -15, 440
+
+GRID_SIZE = 200
+KERNEL = "epanechnikov"
+# The bandwidth is either in pixels or the name of a method that selects it
+# from the shots, see select_bandwidth
+BANDWIDTH = "cv"
+FIXED_BANDWIDTH = 30
+ENGINE = "fft"
+WORKERS = os.cpu_count() or 1
+
+types = ["made", "missed", "all"]
+
+
+def grid_positions(grid_size):
+    x_grid = np.linspace(XMIN, XMAX, grid_size)
+    y_grid = np.linspace(YMIN, YMAX, grid_size)
+    X, Y = np.meshgrid(x_grid, y_grid)
+
+    return np.vstack([X.ravel(), Y.ravel()]).T
+
+
+def compute_density_sklearn(x, y, kernel, bandwidth, grid_size):
+    data = np.vstack([x, y]).T
+
+    kde = KernelDensity(bandwidth=bandwidth, kernel=kernel)
+    kde.fit(data)
+
+    positions = grid_positions(grid_size)
+    Z = np.exp(kde.score_samples(positions))
+
+    return Z.reshape(grid_size, grid_size)
+
+
+# Radial kernel profiles on distances in units of the bandwidth and their
+# normalisation in two dimensions, matching sklearn's KernelDensity
+kernels = {
+    "gaussian": (lambda r: np.exp(-0.5 * r ** 2), 1 / (2 * np.pi), 4),
+    "tophat": (lambda r: (r < 1).astype(float), 1 / np.pi, 1),
+    "epanechnikov": (lambda r: np.clip(1 - r ** 2, 0, None), 2 / np.pi, 1),
+    "linear": (lambda r: np.clip(1 - r, 0, None), 3 / np.pi, 1),
+}
+
+engines = ["sklearn", "fft"]
+
+
+def bin_shots(x, y, grid_size):
+    # Linear binning: every shot is split between the four surrounding grid
+    # points, weighted by its distance to each of them
+    dx = (XMAX - XMIN) / (grid_size - 1)
+    dy = (YMAX - YMIN) / (grid_size - 1)
+    fx = np.clip((np.asarray(x) - XMIN) / dx, 0, grid_size - 1)
+    fy = np.clip((np.asarray(y) - YMIN) / dy, 0, grid_size - 1)
+
+    ix = np.minimum(fx.astype(int), grid_size - 2)
+    iy = np.minimum(fy.astype(int), grid_size - 2)
+    wx = fx - ix
+    wy = fy - iy
+
+    counts = np.zeros(grid_size * grid_size)
+    for oy, ox, w in [
+        (0, 0, (1 - wy) * (1 - wx)),
+        (0, 1, (1 - wy) * wx),
+        (1, 0, wy * (1 - wx)),
+        (1, 1, wy * wx),
+    ]:
+        counts += np.bincount(
+            (iy + oy) * grid_size + ix + ox,
+            weights=w,
+            minlength=grid_size * grid_size
+        )
+
+    return counts.reshape(grid_size, grid_size)
+
+
+def kernel_grid(kernel, bandwidth, grid_size):
+    profile, norm, support = kernels[kernel]
+
+    dx = (XMAX - XMIN) / (grid_size - 1)
+    dy = (YMAX - YMIN) / (grid_size - 1)
+    mx = min(int(np.ceil(support * bandwidth / dx)), grid_size - 1)
+    my = min(int(np.ceil(support * bandwidth / dy)), grid_size - 1)
+
+    X, Y = np.meshgrid(
+        np.arange(-mx, mx + 1) * dx,
+        np.arange(-my, my + 1) * dy
+    )
+    r = np.hypot(X, Y) / bandwidth
+
+    return profile(r) * norm / bandwidth ** 2
+
+
+def fft_convolve(a, k):
+    # Same-size linear convolution of a with the centered kernel k
+    shape = (a.shape[0] + k.shape[0] - 1, a.shape[1] + k.shape[1] - 1)
+    out = np.fft.irfft2(
+        np.fft.rfft2(a, shape) * np.fft.rfft2(k, shape), shape
+    )
+
+    oy, ox = k.shape[0] // 2, k.shape[1] // 2
+    return out[oy:oy + a.shape[0], ox:ox + a.shape[1]]
+
+
+def density_from_counts(counts, n, kernel, bandwidth, grid_size):
+    if kernel not in kernels:
+        raise ValueError(
+            f"{kernel} is not supported by the fft engine. "
+            f"Possible choices: {list(kernels)}"
+        )
+
+    Z = fft_convolve(counts, kernel_grid(kernel, bandwidth, grid_size))
+
+    # Round-off of the FFT leaves tiny negative values where Z is zero
+    return np.clip(Z, 0, None) / max(n, 1)
+
+
+def compute_density_fft(x, y, kernel, bandwidth, grid_size):
+    counts = bin_shots(x, y, grid_size)
+    return density_from_counts(counts, len(x), kernel, bandwidth, grid_size)
+
+
+def compute_density(x, y, kernel, bandwidth, grid_size, engine=ENGINE):
+    if engine == "sklearn":
+        return compute_density_sklearn(x, y, kernel, bandwidth, grid_size)
+    elif engine == "fft":
+        return compute_density_fft(x, y, kernel, bandwidth, grid_size)
+    else:
+        raise ValueError(
+            f"{engine} is not a valid engine. Possible choices: {engines}"
+        )
+
+
+def cache_path(season, entity, shot_type, kernel, bandwidth, grid_size,
+               engine, window=""):
+    return (
+        f"{season_dir(season)}/density/"
+        f"{entity}_{shot_type}_{kernel}_{bandwidth}_{grid_size}_{engine}"
+        f"{window}.npz"
+    )
+
+
+# Raised when the cached values change for the same store, e.g. when the
+# shots of the player pages were moved onto the box score rim
+CACHE_FORMAT = 2
+
+
+def save_npz(path, **arrays):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Worker processes may write the same file, e.g. the counts of a team
+    # needed for both the team and the league
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, format=CACHE_FORMAT, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_npz(path, version=None):
+    # None if the file is missing, of an older format or, when a version is
+    # given, computed from another version of the store
+    if not os.path.exists(path):
+        return None
+
+    cached = dict(np.load(path))
+    if cached.pop("format", None) != CACHE_FORMAT:
+        return None
+    if version is not None and cached["version"] != version:
+        return None
+
+    return cached
+
+
+# Binned counts are additive, so a season grid is the sum of the binned
+# counts of its games and the kernel only has to be applied when reading.
+# Every entity keeps one accumulator per grid size with the made and missed
+# counts and the games folded into them.
+def counts_path(season, entity, grid_size):
+    return f"{season_dir(season)}/density/{entity}_counts_{grid_size}.npz"
+
+
+def build_counts(season, entity, grid_size):
+    shots = select_shots(season, entity)
+    made = shots[shots["made"]]
+    missed = shots[~shots["made"]]
+
+    counts = {
+        "made": bin_shots(made["x"], box_score_y(made), grid_size),
+        "missed": bin_shots(missed["x"], box_score_y(missed), grid_size),
+        "n_made": len(made),
+        "n_missed": len(missed),
+        "match_ids": np.unique(shots["match_id"]),
+    }
+    save_npz(counts_path(season, entity, grid_size), **counts)
+
+    return counts
+
+
+def counts_grid_sizes(season, entity):
+    # Grid sizes with an accumulator of the entity on disk, e.g. the full
+    # grid and the one of the preview, and always GRID_SIZE
+    prefix = f"{entity}_counts_"
+    sizes = {GRID_SIZE}
+    directory = f"{season_dir(season)}/density"
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            size = name[len(prefix):-len(".npz")]
+            if name.startswith(prefix) and name.endswith(".npz") \
+                    and size.isdigit():
+                sizes.add(int(size))
+
+    return sorted(sizes)
+
+
+def load_counts(season, entity, grid_size=GRID_SIZE):
+    counts = load_npz(counts_path(season, entity, grid_size))
+    if counts is not None:
+        # Rebuild when the accumulator and the store disagree, e.g. after a
+        # crawl crashed between writing the store and folding its games
+        shots = select_shots(season, entity)
+        n = counts["n_made"] + counts["n_missed"]
+        if n == len(shots) and np.array_equal(
+            counts["match_ids"], np.unique(shots["match_id"])
+        ):
+            return counts
+
+    return build_counts(season, entity, grid_size)
+
+
+def rebuild_counts(season, entity):
+    for grid_size in counts_grid_sizes(season, entity):
+        build_counts(season, entity, grid_size)
+
+
+def add_games(season, entity, games):
+    # Folds the shots of new games, as (match_id, shots), into every
+    # accumulator of the entity in O(grid) time. The store already holds
+    # them when this is called.
+    match_ids = np.array([match_id for match_id, _ in games], dtype="S12")
+    made = np.concatenate([shots[shots["made"]] for _, shots in games])
+    missed = np.concatenate([shots[~shots["made"]] for _, shots in games])
+
+    for grid_size in counts_grid_sizes(season, entity):
+        path = counts_path(season, entity, grid_size)
+        counts = load_npz(path)
+
+        # Without an accumulator, or when a game was parsed again and its
+        # old shots are gone from the store, it is built from the store,
+        # which covers all the games at once
+        if counts is None or np.isin(match_ids, counts["match_ids"]).any():
+            build_counts(season, entity, grid_size)
+            continue
+
+        counts["made"] += bin_shots(
+            made["x"], box_score_y(made), grid_size
+        )
+        counts["missed"] += bin_shots(
+            missed["x"], box_score_y(missed), grid_size
+        )
+        counts["n_made"] += len(made)
+        counts["n_missed"] += len(missed)
+        counts["match_ids"] = np.union1d(counts["match_ids"], match_ids)
+
+        save_npz(path, **counts)
+
+
+def select_counts(counts, shot_type):
+    if shot_type == "made":
+        return counts["made"], counts["n_made"]
+    elif shot_type == "missed":
+        return counts["missed"], counts["n_missed"]
+    else:
+        return (
+            counts["made"] + counts["missed"],
+            counts["n_made"] + counts["n_missed"]
+        )
+
+
+def aggregate_counts(season, entities, grid_size=GRID_SIZE):
+    total = {"made": 0, "missed": 0, "n_made": 0, "n_missed": 0}
+    for entity in entities:
+        counts = load_counts(season, entity, grid_size)
+        for key in total:
+            total[key] = total[key] + counts[key]
+
+    return total
+
+
+def entity_counts(season, entity, grid_size=GRID_SIZE):
+    # The league is the sum of the accumulators of all teams, so it never
+    # loads a single shot
+    if entity == LEAGUE:
+        return aggregate_counts(season, teams_east + teams_west, grid_size)
+
+    return load_counts(season, entity, grid_size)
+
+
+def binned_counts(season, entity, shot_type, grid_size=GRID_SIZE, last=None,
+                  start=None, end=None, opponent=None):
+    # Game windows are selected from the games index and binned, the
+    # accumulators only cover whole seasons
+    if window_tag(last, start, end, opponent):
+        shots = game_shots(
+            season, entity, shot_type, last, start, end, opponent
+        )
+        counts = bin_shots(shots["x"], box_score_y(shots), grid_size)
+        return counts, len(shots)
+
+    return select_counts(entity_counts(season, entity, grid_size), shot_type)
+
+
+# Bandwidths are selected on the binned counts, so every candidate costs
+# one FFT convolution instead of a pass over all pairs of shots
+bandwidth_methods = ["scott", "cv"]
+
+# Range of the gaussian bandwidths tried by cross-validation, in pixels
+CV_MIN, CV_MAX = 2, 60
+CV_CANDIDATES = 16
+
+
+@lru_cache(maxsize=None)
+def kernel_factor(kernel):
+    # Bandwidths are selected for the gaussian kernel and scaled to the
+    # kernel by the ratio of their AMISE optimal bandwidths in two
+    # dimensions, (R(K) / mu2(K) ** 2) ** (1 / 6)
+    profile, norm, support = kernels[kernel]
+    r, dr = np.linspace(0, support, 100001, retstep=True)
+    k = profile(r) * norm
+    roughness = 2 * np.pi * (k ** 2 * r).sum() * dr
+    mu2 = np.pi * (k * r ** 3).sum() * dr
+
+    return (roughness / mu2 ** 2 * 4 * np.pi) ** (1 / 6)
+
+
+def scott_bandwidth(counts, n, grid_size):
+    # Scott's rule n ** (-1 / 6) * sigma, which is Silverman's rule as well
+    # in two dimensions. The spread of each axis is the smaller of the
+    # standard deviation and the scaled IQR, so the peaks at the rim and
+    # the 3pt line don't inflate it.
+    spreads = []
+    for weights, values in [
+        (counts.sum(axis=0), np.linspace(XMIN, XMAX, grid_size)),
+        (counts.sum(axis=1), np.linspace(YMIN, YMAX, grid_size)),
+    ]:
+        mean = (weights * values).sum() / n
+        std = np.sqrt((weights * (values - mean) ** 2).sum() / n)
+        cdf = np.cumsum(weights) / n
+        iqr = np.interp(0.75, cdf, values) - np.interp(0.25, cdf, values)
+        spreads.append(min(std, iqr / 1.349))
+
+    return np.sqrt(np.mean(np.square(spreads))) * n ** (-1 / 6)
+
+
+def cv_score(counts, n, bandwidth, grid_size):
+    # Leave-one-out log-likelihood of the binned shots. Gaussian kernels
+    # have no zeros, so single outliers don't dictate the bandwidth.
+    kernel = kernel_grid("gaussian", bandwidth, grid_size)
+    smoothed = fft_convolve(counts, kernel)
+    self_weight = kernel[kernel.shape[0] // 2, kernel.shape[1] // 2]
+
+    loo = np.maximum((smoothed - self_weight) / (n - 1), np.finfo(float).tiny)
+    mask = counts > 0
+    return (counts[mask] * np.log(loo[mask])).sum() / n
+
+
+def cv_bandwidth(counts, n, grid_size):
+    # Coarse search over log spaced candidates, then a finer one between
+    # the neighbours of the best
+    def best(candidates):
+        scores = [cv_score(counts, n, h, grid_size) for h in candidates]
+        return int(np.argmax(scores))
+
+    coarse = np.geomspace(CV_MIN, CV_MAX, CV_CANDIDATES)
+    i = best(coarse)
+    fine = np.geomspace(
+        coarse[max(i - 1, 0)], coarse[min(i + 1, len(coarse) - 1)], 9
+    )
+    return fine[best(fine)]
+
+
+def compute_bandwidth(counts, n, kernel, method, grid_size):
+    if n < 2:
+        return FIXED_BANDWIDTH
+
+    if method == "scott":
+        bandwidth = scott_bandwidth(counts, n, grid_size)
+    elif method == "cv":
+        bandwidth = cv_bandwidth(counts, n, grid_size)
+    else:
+        raise ValueError(
+            f"{method} is not a valid bandwidth method. "
+            f"Possible choices: {bandwidth_methods}"
+        )
+
+    return float(bandwidth * kernel_factor(kernel))
+
+
+def bandwidth_path(season, entity, shot_type, kernel, method, window=""):
+    return (
+        f"{season_dir(season)}/density/"
+        f"{entity}_{shot_type}_{kernel}_{method}{window}_bandwidth.npz"
+    )
+
+
+# The bandwidth describes the shots and not the grid they are drawn on, so
+# it is selected on the full grid once and reused for every grid size,
+# e.g. for the coarse preview
+@lru_cache(maxsize=1024)
+def _select_bandwidth(season, entity, shot_type, kernel, method, last, start,
+                      end, opponent, version):
+    path = bandwidth_path(
+        season, entity, shot_type, kernel, method,
+        window_tag(last, start, end, opponent)
+    )
+    cached = load_npz(path, version)
+    if cached is not None:
+        return float(cached["bandwidth"])
+
+    with metrics.timer("heatshot_stage_seconds", stage="bandwidth"):
+        counts, n = binned_counts(
+            season, entity, shot_type, GRID_SIZE, last, start, end, opponent
+        )
+        bandwidth = compute_bandwidth(counts, n, kernel, method, GRID_SIZE)
+
+    save_npz(path, bandwidth=bandwidth, version=version)
+    return bandwidth
+
+
+def select_bandwidth(season, entity, shot_type, kernel=KERNEL, method="cv",
+                     last=None, start=None, end=None, opponent=None):
+    # Bandwidth in pixels for the shots of the entity, cached like the
+    # density grids
+    return _select_bandwidth(
+        season, entity, shot_type, kernel, method, last, start, end,
+        opponent, store_version(season)
+    )
+
+
+# The store version is part of the key, so rescraping an entity invalidates
+# both the in-process and the on-disk layer
+@lru_cache(maxsize=256)
+def _density_grid(season, entity, shot_type, kernel, bandwidth, grid_size,
+                  engine, last, start, end, opponent, version):
+    window = window_tag(last, start, end, opponent)
+
+    # Grids are stored under the bandwidth in pixels, so a new selection
+    # never serves a grid smoothed with another bandwidth
+    if bandwidth in bandwidth_methods:
+        bandwidth = select_bandwidth(
+            season, entity, shot_type, kernel, bandwidth, last, start, end,
+            opponent
+        )
+
+    path = cache_path(
+        season, entity, shot_type, kernel, f"{bandwidth:g}", grid_size,
+        engine, window
+    )
+    metrics.inc("heatshot_cache_misses_total", cache="density_memory")
+    metrics.inc("heatshot_cache_lookups_total", cache="density_disk")
+    with metrics.timer("heatshot_stage_seconds", stage="disk"):
+        cached = load_npz(path, version)
+    if cached is not None:
+        Z = cached["z"]
+        Z.setflags(write=False)
+        return Z
+
+    metrics.inc("heatshot_cache_misses_total", cache="density_disk")
+    if engine == "fft" or (entity == LEAGUE and not window):
+        with metrics.timer("heatshot_stage_seconds", stage="load"):
+            counts, n = binned_counts(
+                season, entity, shot_type, grid_size, last, start, end,
+                opponent
+            )
+        with metrics.timer("heatshot_stage_seconds", stage="kde"):
+            Z = density_from_counts(counts, n, kernel, bandwidth, grid_size)
+    else:
+        with metrics.timer("heatshot_stage_seconds", stage="load"):
+            shots = game_shots(
+                season, entity, shot_type, last, start, end, opponent
+            )
+        with metrics.timer("heatshot_stage_seconds", stage="kde"):
+            Z = compute_density(
+                shots["x"], box_score_y(shots), kernel, bandwidth,
+                grid_size, engine
+            )
+
+    with metrics.timer("heatshot_stage_seconds", stage="disk"):
+        save_npz(path, z=Z, version=version)
+
+    Z.setflags(write=False)
+    return Z
+
+
+def density_grid(season, entity, shot_type, kernel=KERNEL,
+                 bandwidth=BANDWIDTH, grid_size=GRID_SIZE, engine=ENGINE,
+                 last=None, start=None, end=None, opponent=None):
+    metrics.inc("heatshot_cache_lookups_total", cache="density_memory")
+    return _density_grid(
+        season, entity, shot_type, kernel, bandwidth, grid_size, engine,
+        last, start, end, opponent, store_version(season)
+    )
+
+
+def difference_grid(season, entity, other, shot_type, **kwargs):
+    # Both grids are normalised by their number of shots, so the difference
+    # compares where the shots go and not how many there are. Keyword
+    # arguments are passed to density_grid for both.
+    bandwidth = kwargs.pop("bandwidth", BANDWIDTH)
+    if bandwidth in bandwidth_methods:
+        # Both sides are smoothed with the bandwidth selected for entity,
+        # otherwise the difference is dominated by the smoothing
+        window = {
+            key: kwargs.get(key)
+            for key in ["last", "start", "end", "opponent"]
+        }
+        bandwidth = select_bandwidth(
+            season, entity, shot_type, kwargs.get("kernel", KERNEL),
+            bandwidth, **window
+        )
+
+    return (
+        density_grid(season, entity, shot_type, bandwidth=bandwidth, **kwargs)
+        - density_grid(season, other, shot_type, bandwidth=bandwidth, **kwargs)
+    )
+
+
+def precompute_entity(season, entity, kernel=KERNEL, bandwidth=BANDWIDTH,
+                      grid_size=GRID_SIZE, engine=ENGINE):
+    # Players have no games, so only teams get the common game windows
+    windows = [{}] if entity in players else common_windows
+    for shot_type in types:
+        for window in windows:
+            density_grid(
+                season, entity, shot_type,
+                kernel=kernel, bandwidth=bandwidth, grid_size=grid_size,
+                engine=engine, **window
+            )
+
+    return entity
+
+
+def precompute(season, kernel=KERNEL, bandwidth=BANDWIDTH,
+               grid_size=GRID_SIZE, engine=ENGINE, workers=WORKERS,
+               mp_context=None):
+    # The grids end up in the on-disk cache, so processes that only compute
+    # them warm the cache of the app as well
+    store_version(season)
+
+    # The league sums the counts of the teams, so it is submitted last to
+    # find most of them built already
+    entities = teams_east + teams_west + players + [LEAGUE]
+    task = partial(
+        precompute_entity, season, kernel=kernel, bandwidth=bandwidth,
+        grid_size=grid_size, engine=engine
+    )
+    with ProcessPoolExecutor(workers, mp_context=mp_context) as pool:
+        futures = [pool.submit(task, entity) for entity in entities]
+        for i, future in enumerate(as_completed(futures), start=1):
+            print(f"[{i}/{len(entities)}] {future.result()}")
+
+
+def parse_bandwidth(value):
+    return value if value in bandwidth_methods else float(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute the density grids of all teams and players"
+    )
+    parser.add_argument("--season", default="2024")
+    parser.add_argument("--kernel", default=KERNEL)
+    parser.add_argument(
+        "--bandwidth", type=parse_bandwidth, default=BANDWIDTH,
+        help=f"in pixels or one of {bandwidth_methods}"
+    )
+    parser.add_argument("--grid-size", type=int, default=GRID_SIZE)
+    parser.add_argument("--engine", choices=engines, default=ENGINE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    precompute(
+        args.season, args.kernel, args.bandwidth, args.grid_size, args.engine,
+        args.workers
+    )
@@ -0,0 +1,56 @@
+from functools import lru_cache
+
+import numpy as np
+
+import metrics
+from games import game_shots
+from store import store_version
+
+# Shots are counted per foot from 0 to MAX_DISTANCE ft, the rare heaves from
+# beyond fall into the last bin
+MAX_DISTANCE = 94
+BINS = MAX_DISTANCE + 1
+
+
+def distance_counts(shots):
+    # Row 0 counts the made shots per foot, row 1 the missed ones. The bins
+    # are the same for every entity, so counts of games, entities and seasons
+    # are merged by adding them.
+    distance = np.clip(shots["distance"].astype(np.int64), 0, MAX_DISTANCE)
+    key = np.where(shots["made"], 0, BINS) + distance
+    return np.bincount(key, minlength=2 * BINS).reshape(2, BINS)
+
+
+@lru_cache(maxsize=1024)
+def _distance_distribution(season, entity, last, start, end, opponent,
+                           version):
+    metrics.inc("heatshot_cache_misses_total", cache="distances")
+    with metrics.timer("heatshot_stage_seconds", stage="load"):
+        shots = game_shots(
+            season, entity, last=last, start=start, end=end,
+            opponent=opponent
+        )
+    with metrics.timer("heatshot_stage_seconds", stage="distances"):
+        counts = distance_counts(shots)
+    counts.setflags(write=False)
+    return counts
+
+
+def distance_distribution(season, entity, last=None, start=None, end=None,
+                          opponent=None):
+    # Made and missed counts per foot of the shots of the selected games.
+    # The store version is part of the key, so a new crawl invalidates it.
+    metrics.inc("heatshot_cache_lookups_total", cache="distances")
+    return _distance_distribution(
+        season, entity, last, start, end, opponent, store_version(season)
+    )
+
+
+def field_goal_pct(counts):
+    made, missed = counts
+    attempts = made + missed
+    return np.divide(
+        made, attempts,
+        out=np.zeros(len(made)),
+        where=attempts > 0
+    )
@@ -0,0 +1,134 @@
+import asyncio
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pagecache import PageCache
+
+# Basketball-Reference allows at most 20 requests per minute
+RATE = 20 / 60
+BURST = 1
+CONCURRENCY = 4
+RETRIES = 5
+BACKOFF = 2
+TIMEOUT = 30
+
+retry_statuses = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        # Tokens may go negative: every caller reserves the next free slot
+        # before sleeping, so waiting callers are served in order. There is
+        # no await before the reservation, which makes it atomic.
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        self.tokens -= 1
+
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def penalize(self, seconds):
+        # Pushes every following request back, e.g. on 429 Retry-After
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+# Shared by all crawls of the process so consecutive batches of requests
+# together stay within the rate limit
+default_limiter = TokenBucket(RATE, BURST)
+default_cache = PageCache()
+
+
+def make_session(concurrency=CONCURRENCY):
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=concurrency,
+        pool_maxsize=concurrency
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def retry_delay(response, attempt):
+    retry_after = None
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+
+    return BACKOFF ** attempt + random.uniform(0, 1)
+
+
+async def fetch(session, url, limiter, cache, retries=RETRIES):
+    response = None
+    for attempt in range(retries + 1):
+        await limiter.acquire()
+        try:
+            response = await asyncio.to_thread(
+                session.get, url,
+                headers=cache.conditional_headers(url),
+                timeout=TIMEOUT
+            )
+        except requests.RequestException as e:
+            print(f"Request to {url} failed: {e}")
+            response = None
+        else:
+            if response.status_code == 304:
+                return cache.get(url)
+            elif response.status_code == 200:
+                cache.put(url, response)
+                return response
+            elif response.status_code not in retry_statuses:
+                return response
+
+        if attempt < retries:
+            delay = retry_delay(response, attempt)
+            if response is not None and response.status_code == 429:
+                limiter.penalize(delay)
+            else:
+                await asyncio.sleep(delay)
+
+    return response
+
+
+async def fetch_all(urls, limiter=None, cache=None, concurrency=CONCURRENCY,
+                    retries=RETRIES):
+    limiter = limiter or default_limiter
+    cache = cache or default_cache
+    semaphore = asyncio.Semaphore(concurrency)
+
+    with make_session(concurrency) as session:
+        async def bounded_fetch(url):
+            async with semaphore:
+                return await fetch(session, url, limiter, cache, retries)
+
+        try:
+            return await asyncio.gather(
+                *[bounded_fetch(url) for url in urls]
+            )
+        finally:
+            cache.save()
+
+
+def fetch_pages(urls, offline=False, **kwargs):
+    # Returns the responses in the order of the urls, None where the request
+    # failed after all retries. Offline, pages are only read from the cache.
+    if offline:
+        cache = kwargs.get("cache") or default_cache
+        return [cache.get(url) for url in urls]
+
+    return asyncio.run(fetch_all(urls, **kwargs))
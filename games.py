@@ -0,0 +1,180 @@
+from functools import lru_cache
+
+import numpy as np
+
+from store import LEAGUE, open_store, select_shots, store_version
+from utils import teams_east, teams_west
+
+# One row per game of a team. Within the made and the missed shots of a
+# team the store is ordered by game, so the shots of a game are the rows
+# [made_start, made_stop) and [missed_start, missed_stop) of the store.
+game_dtype = np.dtype([
+    ("team", "S3"),
+    ("match_id", "S12"),
+    ("date", "i4"),
+    ("home", "?"),
+    ("opponent", "S3"),
+    ("made_start", "i8"),
+    ("made_stop", "i8"),
+    ("missed_start", "i8"),
+    ("missed_stop", "i8"),
+])
+
+conferences = {"East": teams_east, "West": teams_west}
+
+# Game windows offered in the app, their density grids are precomputed
+common_windows = [
+    {},
+    {"last": 10},
+    {"opponent": "East"},
+    {"opponent": "West"},
+]
+
+
+def game_offsets(match_ids, offset):
+    # match_ids are sorted, returns the games with their row ranges
+    games, starts, counts = np.unique(
+        match_ids, return_index=True, return_counts=True
+    )
+    return games, offset + starts, offset + starts + counts
+
+
+def build_games(shots, index):
+    rows = []
+    for team in teams_east + teams_west:
+        if team not in index:
+            continue
+
+        start, split, stop = index[team]
+        made = game_offsets(shots["match_id"][start:split], start)
+        missed = game_offsets(shots["match_id"][split:stop], split)
+
+        match_ids = np.union1d(made[0], missed[0])
+        games = np.zeros(len(match_ids), dtype=game_dtype)
+        games["team"] = team
+        games["match_id"] = match_ids
+
+        # A game without made or missed shots gets an empty range where its
+        # shots would be, so consecutive games stay contiguous
+        for prefix, (found, starts, stops), end in [
+            ("made", made, split), ("missed", missed, stop)
+        ]:
+            i = np.searchsorted(found, match_ids)
+            hit = np.isin(match_ids, found)
+            games[f"{prefix}_start"] = np.append(starts, end)[i]
+            games[f"{prefix}_stop"] = np.where(
+                hit, np.append(stops, end)[i], games[f"{prefix}_start"]
+            )
+
+        rows.append(games)
+
+    if not rows:
+        return np.zeros(0, dtype=game_dtype)
+
+    games = np.concatenate(rows)
+    games["date"] = games["match_id"].astype("S8").astype(int)
+
+    # Match ids end with the code of the home team. The opponent of a home
+    # game is the other team with shots in it, which is unknown when the
+    # box score of the visitors was not scraped.
+    home_team = np.array([m[-3:] for m in games["match_id"]], dtype="S3")
+    games["home"] = home_team == games["team"]
+    games["opponent"] = np.where(games["home"], b"", home_team)
+
+    order = np.argsort(games["match_id"], kind="stable")
+    sorted_ids = games["match_id"][order]
+    same_as_next = sorted_ids[1:] == sorted_ids[:-1]
+    pairs = order[:-1][same_as_next], order[1:][same_as_next]
+    for a, b in [pairs, pairs[::-1]]:
+        games["opponent"][a] = games["team"][b]
+
+    return games
+
+
+@lru_cache(maxsize=16)
+def _games_index(season, version):
+    shots, index = open_store(season)
+    games = build_games(shots, index)
+    games.setflags(write=False)
+    return games
+
+
+def games_index(season):
+    return _games_index(season, store_version(season))
+
+
+def opponent_codes(opponent):
+    # An opponent is a team code or the name of a conference
+    if opponent in conferences:
+        return np.array(conferences[opponent], dtype="S3")
+
+    return np.array([opponent], dtype="S3")
+
+
+def select_games(season, team, last=None, start=None, end=None,
+                 opponent=None):
+    # Games of the team in order, filtered by date (both inclusive, like
+    # 20231025), opponent and finally to the last n of them
+    games = games_index(season)
+    games = games[games["team"] == team.encode()]
+
+    if start is not None:
+        games = games[games["date"] >= int(start)]
+    if end is not None:
+        games = games[games["date"] <= int(end)]
+    if opponent is not None:
+        games = games[np.isin(games["opponent"], opponent_codes(opponent))]
+    if last is not None:
+        games = games[-last:]
+
+    return games
+
+
+def window_tag(last=None, start=None, end=None, opponent=None):
+    # Suffix of the cache files of a game window, empty for the full season
+    tag = ""
+    if start is not None or end is not None:
+        tag += f"_{start or ''}-{end or ''}"
+    if opponent is not None:
+        tag += f"_vs{opponent}"
+    if last is not None:
+        tag += f"_last{last}"
+
+    return tag
+
+
+def game_shots(season, entity, shot_type="all", last=None, start=None,
+               end=None, opponent=None):
+    # Shots of the selected games. Player shots have no games, so any filter
+    # on games leaves a player without shots.
+    if last is None and start is None and end is None and opponent is None:
+        return select_shots(season, entity, shot_type)
+
+    if entity == LEAGUE:
+        teams = teams_east + teams_west
+    elif entity in teams_east + teams_west:
+        teams = [entity]
+    else:
+        return select_shots(season, entity, shot_type)[:0]
+
+    shots = open_store(season)[0]
+    prefixes = ["made", "missed"] if shot_type == "all" else [shot_type]
+
+    ranges = []
+    for team in teams:
+        games = select_games(season, team, last, start, end, opponent)
+        for prefix in prefixes:
+            starts = games[f"{prefix}_start"]
+            stops = games[f"{prefix}_stop"]
+            if len(games) and np.all(starts[1:] == stops[:-1]):
+                # Consecutive games are a single slice
+                ranges.append((starts[0], stops[-1]))
+            else:
+                ranges.extend(zip(starts, stops))
+
+    if not ranges:
+        return shots[:0]
+    if len(ranges) == 1:
+        return shots[ranges[0][0]:ranges[0][1]]
+
+    return np.concatenate([shots[a:b] for a, b in ranges])
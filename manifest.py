@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from store import season_dir
+
+# The crawl manifest records for every page of a season when it was fetched,
+# the HTTP status, a hash of its content and how many shots were parsed from
+# it. Keys are "match:<team>:<match_id>" and "player:<player>".
+
+
+def manifest_path(season):
+    return f"{season_dir(season)}/manifest.json"
+
+
+def load_manifest(season):
+    path = manifest_path(season)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(season, manifest):
+    os.makedirs(season_dir(season), exist_ok=True)
+
+    path = manifest_path(season)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def content_hash(response):
+    return hashlib.sha256(response.content).hexdigest()
+
+
+def record(manifest, key, url, response, shots=None):
+    manifest[key] = {
+        "url": url,
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+        "status": response.status_code if response is not None else None,
+        "hash": content_hash(response) if response is not None else None,
+        "shots": shots,
+    }
+
+
+def is_done(manifest, key):
+    # Only pages that were fetched and parsed count, failures are retried
+    entry = manifest.get(key)
+    return (
+        entry is not None
+        and entry["status"] == 200
+        and entry["shots"] is not None
+    )
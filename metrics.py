@@ -0,0 +1,180 @@
+import bisect
+import os
+import threading
+import time
+from functools import wraps
+
+# Off unless HEATSHOT_METRICS=1 is set or enable() is called. Disabled,
+# every hook returns after checking this flag.
+enabled = os.environ.get("HEATSHOT_METRICS") == "1"
+
+LATENCY_BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+    5, 10
+]
+SIZE_BUCKETS = [1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7]
+
+# name: (type, help, buckets of histograms)
+definitions = {
+    "heatshot_callback_seconds": (
+        "histogram", "Latency of the Dash callbacks", LATENCY_BUCKETS
+    ),
+    "heatshot_stage_seconds": (
+        "histogram", "Time spent per stage of serving a chart",
+        LATENCY_BUCKETS
+    ),
+    "heatshot_payload_bytes": (
+        "histogram", "Size of the callback responses per output",
+        SIZE_BUCKETS
+    ),
+    "heatshot_cache_lookups_total": (
+        "counter", "Lookups per cache", None
+    ),
+    "heatshot_cache_misses_total": (
+        "counter", "Lookups per cache that had to compute the value", None
+    ),
+}
+
+_lock = threading.Lock()
+
+# name: {sorted label items: values}. Histograms keep the count per bucket,
+# the last bucket is +Inf, followed by the sum of the observed values.
+_series = {name: {} for name in definitions}
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with _lock:
+        for series in _series.values():
+            series.clear()
+
+
+def observe(name, value, **labels):
+    if not enabled:
+        return
+
+    buckets = definitions[name][2]
+    key = tuple(sorted(labels.items()))
+    i = bisect.bisect_left(buckets, value)
+    with _lock:
+        values = _series[name].get(key)
+        if values is None:
+            values = _series[name][key] = [0] * (len(buckets) + 1) + [0.0]
+        values[i] += 1
+        values[-1] += value
+
+
+def inc(name, value=1, **labels):
+    if not enabled:
+        return
+
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        _series[name][key] = _series[name].get(key, 0) + value
+
+
+class timer:
+    # with timer("heatshot_stage_seconds", stage="kde"): ...
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            observe(
+                self.name, time.perf_counter() - self.start, **self.labels
+            )
+
+
+def instrument(callback):
+    # Times every call of a Dash callback under its function name
+    @wraps(callback)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return callback(*args, **kwargs)
+
+        with timer("heatshot_callback_seconds", callback=callback.__name__):
+            return callback(*args, **kwargs)
+
+    return wrapper
+
+
+def format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+
+    escaped = [
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"')
+         .replace("\n", "\\n"))
+        for k, v in items
+    ]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render():
+    # Prometheus text exposition format 0.0.4
+    lines = []
+    with _lock:
+        snapshot = {
+            name: {key: list(values) if isinstance(values, list) else values
+                   for key, values in series.items()}
+            for name, series in _series.items()
+        }
+
+    for name, (kind, description, buckets) in definitions.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, values in sorted(snapshot[name].items()):
+            if kind == "counter":
+                lines.append(f"{name}{format_labels(labels)} {values}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip(buckets + ["+Inf"], values[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(
+                    f"{name}_bucket{format_labels(labels, [('le', le)])} "
+                    f"{cumulative}"
+                )
+            lines.append(f"{name}_sum{format_labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+def install(server, path="/metrics"):
+    # Serves the metrics on the Flask server of a Dash app to local clients
+    # and records the size of every callback response
+    from flask import Response, abort, request
+
+    @server.route(path)
+    def metrics_endpoint():
+        if request.remote_addr not in ("127.0.0.1", "::1"):
+            abort(403)
+        return Response(
+            render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    @server.after_request
+    def record_payload(response):
+        if enabled and request.path.endswith("/_dash-update-component"):
+            body = request.get_json(silent=True) or {}
+            observe(
+                "heatshot_payload_bytes",
+                response.calculate_content_length() or 0,
+                output=body.get("output", "")
+            )
+        return response
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+import requests
+
+from store import data_dir
+
+cache_dir = f"{data_dir}/pages"
+
+
+class PageCache:
+    # Raw pages are stored gzip compressed under the hash of their content,
+    # the index maps every url to the hash of its latest version together
+    # with the validators needed for conditional requests
+
+    def __init__(self, path=cache_dir):
+        self.path = path
+        self.index_path = f"{path}/index.json"
+        self.index = None
+
+    def load_index(self):
+        if self.index is None:
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as f:
+                    self.index = json.load(f)
+            else:
+                self.index = {}
+
+        return self.index
+
+    def save(self):
+        if self.index is None:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def object_path(self, digest):
+        return f"{self.path}/objects/{digest[:2]}/{digest}.html.gz"
+
+    def conditional_headers(self, url):
+        entry = self.load_index().get(url)
+        if entry is None:
+            return {}
+        if not os.path.exists(self.object_path(entry["hash"])):
+            return {}
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def put(self, url, response):
+        digest = hashlib.sha256(response.content).hexdigest()
+
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with gzip.open(tmp_path, "wb") as f:
+                f.write(response.content)
+            os.replace(tmp_path, path)
+
+        self.load_index()[url] = {
+            "hash": digest,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def get(self, url):
+        # Returns the cached page as a response, None if it is not cached
+        entry = self.load_index().get(url)
+        if entry is None:
+            return None
+
+        path = self.object_path(entry["hash"])
+        if not os.path.exists(path):
+            return None
+
+        with gzip.open(path, "rb") as f:
+            content = f.read()
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+        response._content = content
+        response.encoding = "utf-8"
+        return response
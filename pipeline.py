@@ -0,0 +1,108 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fetch
+from fetch import CONCURRENCY, RETRIES, make_session
+
+# Fetched pages waiting to be parsed. When the parsers fall behind, fetchers
+# block on the full queue instead of holding every page in memory.
+QUEUE_SIZE = 16
+WORKERS = 4
+
+
+class StageStats:
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0
+        self.bytes = 0
+
+    def add(self, seconds, size=0):
+        self.items += 1
+        self.busy += seconds
+        self.bytes += size
+
+    def summary(self, elapsed):
+        rate = self.items / elapsed if elapsed else 0
+        return (
+            f"{self.name:>6}: {self.items:5d} items, {self.busy:8.2f}s busy, "
+            f"{rate:7.2f} items/s, {self.bytes / 1e6:8.2f} MB"
+        )
+
+
+async def run_pipeline(jobs, parse, write, accept=None, offline=False,
+                       workers=WORKERS, queue_size=QUEUE_SIZE,
+                       concurrency=CONCURRENCY, retries=RETRIES):
+    # jobs are (job, url) pairs. Every fetched page with status 200 that
+    # accept(job, response) allows is handed to parse(job, html) in a worker
+    # process, then write(job, response, result) runs in this process with
+    # result None for pages that were not parsed.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(queue_size)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {name: StageStats(name) for name in ["fetch", "parse", "write"]}
+
+    async def fetch_job(session, job, url):
+        # The slot is held until the page is queued, so at most concurrency
+        # pages wait for a full queue
+        async with semaphore:
+            start = time.perf_counter()
+            if offline:
+                response = fetch.default_cache.get(url)
+            else:
+                response = await fetch.fetch(
+                    session, url, fetch.default_limiter, fetch.default_cache,
+                    retries
+                )
+            size = len(response.content) if response is not None else 0
+            stats["fetch"].add(time.perf_counter() - start, size)
+
+            await queue.put((job, response))
+
+    async def produce(session):
+        try:
+            await asyncio.gather(
+                *[fetch_job(session, job, url) for job, url in jobs]
+            )
+        finally:
+            fetch.default_cache.save()
+            for _ in range(workers):
+                await queue.put(None)
+
+    async def consume(pool):
+        while (item := await queue.get()) is not None:
+            job, response = item
+
+            result = None
+            if (response is not None and response.status_code == 200
+                    and (accept is None or accept(job, response))):
+                start = time.perf_counter()
+                result = await loop.run_in_executor(
+                    pool, parse, job, response.text
+                )
+                stats["parse"].add(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            write(job, response, result)
+            stats["write"].add(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with make_session(concurrency) as session, \
+            ProcessPoolExecutor(workers) as pool:
+        await asyncio.gather(
+            produce(session),
+            *[consume(pool) for _ in range(workers)]
+        )
+    elapsed = time.perf_counter() - start
+
+    print(f"Pipeline finished {len(jobs)} pages in {elapsed:.2f}s")
+    for stage in stats.values():
+        print(stage.summary(elapsed))
+
+    return stats
+
+
+def crawl(jobs, parse, write, **kwargs):
+    return asyncio.run(run_pipeline(jobs, parse, write, **kwargs))
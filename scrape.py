@@ -1,244 +1,307 @@
-import os
+import argparse
 import re
-import time
+from html import unescape
 
 import numpy as np
-import requests
 from bs4 import BeautifulSoup
-from tqdm import tqdm
 
+from density import add_games, rebuild_counts
+from fetch import fetch_pages
+from manifest import (
+    content_hash, is_done, load_manifest, record, save_manifest
+)
+from pipeline import crawl
+from store import make_shots, shot_distance, update_store
 from utils import teams_east, teams_west, players
 
 base_url = "https://www.basketball-reference.com/"
 
+# Number of parsed pages written to the store and the manifest at once
+CHECKPOINT_GAMES = 10
 
-def process_response(response, category):
-    if category == "match":
-        html = response.text
-        soup = BeautifulSoup(html, "html.parser")
 
-        r = re.compile(r"^shots-")
-        shot_charts = soup.find_all("div", {"id": r})
+distance_pattern = re.compile(r"from (\d+) ft")
+shooter_pattern = re.compile(r"<br>(.+?) (?:made|missed) ")
 
-        r = re.compile(r"^tooltip")
-        points = shot_charts[0].find_all("div", {"class": r})
-    elif category == "player":
-        html = response.text
-        soup = BeautifulSoup(re.sub("<!--|-->", "", html), "html.parser")
+# Opening and closing div tags. Attribute values are matched as a whole
+# because the tooltips contain "<br>" inside their tip attribute.
+div_pattern = re.compile(
+    r"<div\b((?:\s+[\w:-]+(?:\s*=\s*(?:\"[^\"]*\"|'[^']*'|[^\s>]+))?)*)"
+    r"\s*(/?)>|</div\s*>",
+    re.IGNORECASE
+)
+attr_pattern = re.compile(
+    r"([\w:-]+)(?:\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s>]+)))?"
+)
+
+
+def parse_attrs(attrs):
+    return {
+        name.lower(): unescape(double or single or bare)
+        for name, double, single, bare in attr_pattern.findall(attrs)
+    }
+
+
+def iter_tooltips(html, pattern):
+    # Walks the div tags of the shot chart matched by pattern and yields the
+    # attributes of its tooltips without building a DOM. Comment markers are
+    # not special, so charts inside comments are found as well.
+    chart = pattern.search(html)
+    if chart is None:
+        return
 
-        shot_chart = soup.find_all("div", {"class": "shot-area"})[0]
+    depth = 0
+    for tag in div_pattern.finditer(html, chart.start()):
+        if tag.group(0).startswith("</"):
+            depth -= 1
+            if depth == 0:
+                return
+            continue
 
-        r = re.compile(r"^tooltip")
-        points = shot_chart.find_all("div", {"class": r})
+        if not tag.group(2):
+            depth += 1
+
+        attrs = parse_attrs(tag.group(1))
+        classes = attrs.get("class", "").split()
+        if any(c.startswith("tooltip") for c in classes):
+            attrs["class"] = classes
+            yield attrs
+
+
+def chart_pattern(category, team=""):
+    if category == "match":
+        # Box scores have one chart per team, the first one is not
+        # necessarily the chart of the team we are parsing
+        return re.compile(
+            rf"<div\b[^>]*\bid=[\"']shots-{re.escape(team)}[\"']",
+            re.IGNORECASE
+        )
+    elif category == "player":
+        return re.compile(
+            r"<div\b[^>]*\bclass=[\"'][^\"']*\bshot-area\b",
+            re.IGNORECASE
+        )
     else:
         raise ValueError(f"{category} is not a valid category")
 
-    made_x = []
-    made_y = []
-    missed_x = []
-    missed_y = []
+
+def parse_shots(html, category, team="", player="", match_id=""):
+    points = iter_tooltips(html, chart_pattern(category, team))
+
+    xs = []
+    ys = []
+    made = []
+    dists = []
+    shooters = []
     for point in points:
         style = point["style"]
         x_px, y_px = style.split(";")[1], style.split(";")[0]
-        x = x_px.split(":")[-1].strip("px")
-        y = y_px.split(":")[-1].strip("px")
-
-        if "miss" in point["class"]:
-            missed_x.append(int(x))
-            missed_y.append(int(y))
-        else:
-            made_x.append(int(x))
-            made_y.append(int(y))
-
-    return (
-        np.array(missed_x),
-        np.array(missed_y),
-        np.array(made_x),
-        np.array(made_y)
+        xs.append(int(x_px.split(":")[-1].strip("px")))
+        ys.append(int(y_px.split(":")[-1].strip("px")))
+        made.append("make" in point["class"])
+
+        tip = point["tip"]
+        dist = distance_pattern.search(tip)
+        dists.append(int(dist.group(1)) if dist else -1)
+
+        # Player pages only contain shots of that player
+        shooter = shooter_pattern.search(tip) if category == "match" else None
+        shooters.append(shooter.group(1) if shooter else "")
+
+    xs = np.array(xs, dtype=int)
+    ys = np.array(ys, dtype=int)
+
+    # Fall back to the distance from the coordinates if the tooltip has none
+    dists = np.array(dists, dtype=int)
+    missing = dists < 0
+    dists[missing] = shot_distance(
+        xs[missing], ys[missing], player=category == "player"
     )
 
+    return make_shots(
+        xs, ys, np.array(made, dtype=bool),
+        team=team,
+        player=player,
+        match_id=match_id,
+        distance=dists,
+        shooter=shooters
+    )
 
-def parse_matches(response, team, option):
-    print("Parsing matches for", team)
-
-    newpath = f"data/{team}"
-    if not os.path.exists(newpath):
-        os.makedirs(newpath)
 
+def parse_schedule(response):
     html = response.text
     soup = BeautifulSoup(re.sub("<!--|-->", "", html), "html.parser")
 
     table = soup.find("table")
     rows = table.find_all("tr")
-    i = 0
 
-    dists_made = []
-    dists_missed = []
+    match_ids = []
     for row in rows:
         is_row = bool(row.find_all("th", {"scope": "row"}))
         if is_row:
             match_link = row.find_all("a")[1]["href"]
-            match_id = match_link.split("/")[2].split(".")[0]
-            print("Parsing", match_id)
-
-            i += 1
-            if i % 30 == 0:
-                for _ in tqdm(range(0, 60), desc="Request cooldown (60s)"):
-                    time.sleep(1)
-
-            if option == "points":
-                url = f"{base_url}/boxscores/shot-chart/{match_id}.html"
-
-                response = requests.get(url)
-                if response.status_code == 200:
-                    missed_x, missed_y, made_x, made_y = process_response(
-                        response=response,
-                        category="match"
-                    )
-                    np.savez(f"data/{team}/missed_{match_id}", missed_x, missed_y)
-                    np.savez(f"data/{team}/made_{match_id}", made_x, made_y)
-            elif option == "dists":
-                url = f"{base_url}/boxscores/shot-chart/{match_id}.html"
-
-                response = requests.get(url)
-                if response.status_code == 200:
-                    current_dists_made, current_dists_missed = process_response_dists(
-                        response=response,
-                        category="team"
-                    )
-
-                    dists_made.extend(current_dists_made)
-                    dists_missed.extend(current_dists_missed)
-
-    if option == "dists" and dists_made:
-        hist_made = np.histogram(
-            dists_made,
-            bins=[i for i in range(min(dists_made), max(dists_made))]
-        )
-        hist_missed = np.histogram(
-            dists_missed,
-            bins=[i for i in range(min(dists_missed), max(dists_missed))]
-        )
+            match_ids.append(match_link.split("/")[2].split(".")[0])
 
-        np.savez(f"data/{team}/dists", hist_made[0], hist_made[1])
-        np.savez(f"data/{team}/dists_missed", hist_missed[0], hist_missed[1])
+    return match_ids
 
 
-def parse_team_shot_points(season):
+def job_key(job):
+    if job["category"] == "match":
+        return f"match:{job['team']}:{job['match_id']}"
+    else:
+        return f"player:{job['player']}"
 
-    for team in teams_east + teams_west:
-        url = f"{base_url}/teams/{team}/{season}_games.html"
-        response = requests.get(url)
-        if response.status_code == 200:
-            parse_matches(response, team, option="points")
 
+def parse_job(job, html):
+    # Runs in the parser processes of the pipeline
+    return parse_shots(html, **job)
 
-def parse_players(season):
 
-    i = 0
-    for player in players:
-        newpath = f"data/{player}"
-        if not os.path.exists(newpath):
-            os.makedirs(newpath)
-
-        i += 1
-        if i % 30 == 0:
-            for _ in tqdm(range(0, 60), desc="Request cooldown (60s)"):
-                time.sleep(1)
-
-        url = f"{base_url}/players/{player[0]}/{player}/shooting/{season}"
-
-        print("Parsing", player)
-        response = requests.get(url)
-        if response.status_code == 200:
-            missed_x, missed_y, made_x, made_y = process_response(
-                response=response,
-                category="player"
+class ShotWriter:
+    # Collects parsed pages and commits them in chunks: store first, then
+    # the manifest, so an interrupted crawl resumes after the last chunk
+
+    def __init__(self, season, manifest):
+        self.season = season
+        self.manifest = manifest
+        self.pending = []
+        self.records = []
+
+    def write(self, job, response, shots):
+        key = job_key(job)
+        url = response.url if response is not None else None
+        print("Parsing", key)
+
+        if response is None or response.status_code != 200:
+            self.records.append((key, url, response, None))
+        elif shots is None:
+            print("Unchanged", key)
+        else:
+            self.pending.append((job, shots))
+            self.records.append((key, url, response, len(shots)))
+
+        if len(self.pending) >= CHECKPOINT_GAMES:
+            self.flush()
+
+    def flush(self):
+        games = {}
+        for job, shots in self.pending:
+            if job["category"] == "match":
+                games.setdefault(job["team"], []).append((job, shots))
+            else:
+                update_store(self.season, shots, job["player"])
+                rebuild_counts(self.season, job["player"])
+
+        for team, team_games in games.items():
+            update_store(
+                self.season,
+                np.concatenate([shots for _, shots in team_games]),
+                team,
+                match_ids=[job["match_id"] for job, _ in team_games]
             )
-            np.savez(f"data/{player}/missed", missed_x, missed_y)
-            np.savez(f"data/{player}/made", made_x, made_y)
+            add_games(self.season, team, [
+                (job["match_id"], shots) for job, shots in team_games
+            ])
 
+        for key, url, response, n_shots in self.records:
+            record(self.manifest, key, url, response, shots=n_shots)
+        save_manifest(self.season, self.manifest)
 
-def process_response_dists(response, category):
-    html = response.text
-    soup = BeautifulSoup(re.sub("<!--|-->", "", html), "html.parser")
+        self.pending = []
+        self.records = []
 
-    shot_chart = soup.find_all("div", {"class": "shot-area"})[0]
 
-    r = re.compile(r"^tooltip")
-    points = shot_chart.find_all("div", {"class": r})
+def crawl_pages(season, manifest, jobs, accept=None, offline=False):
+    writer = ShotWriter(season, manifest)
+    crawl(jobs, parse_job, writer.write, accept=accept, offline=offline)
+    writer.flush()
 
-    dists_made = []
-    dists_missed = []
-    for point in points:
-        if category == "player":
-            message = point["tip"].split("<br>")[2]
-        elif category == "team":
-            message = point["tip"].split("<br>")[1]
-        else:
-            raise ValueError(f"{category} is not a valid category.")
 
-        dist = int(message.split(" ")[-2])
+def fetch_team_schedules(season, teams, offline=False):
+    return fetch_pages([
+        f"{base_url}/teams/{team}/{season}_games.html" for team in teams
+    ], offline=offline)
 
-        if "make" in point["class"]:
-            dists_made.append(dist)
-        else:
-            dists_missed.append(dist)
 
-    if category == "team":
-        return dists_made, dists_missed
-    else:
-        hist_made = np.histogram(
-            dists_made,
-            bins=[i for i in range(min(dists_made), max(dists_made))]
-        )
-        hist_missed = np.histogram(
-            dists_missed,
-            bins=[i for i in range(min(dists_missed), max(dists_missed))]
-        )
+def match_url(match_id):
+    return f"{base_url}/boxscores/shot-chart/{match_id}.html"
 
-        return hist_made, hist_missed
 
+def player_url(season, player):
+    return f"{base_url}/players/{player[0]}/{player}/shooting/{season}"
 
-def parse_player_shot_distances(season):
 
-    i = 0
-    for player in players:
-        newpath = f"data/{player}"
-        if not os.path.exists(newpath):
-            os.makedirs(newpath)
-
-        i += 1
-        if i % 30 == 0:
-            for _ in tqdm(range(0, 60), desc="Request cooldown (60s)"):
-                time.sleep(1)
-
-        url = f"{base_url}/players/{player[0]}/{player}/shooting/{season}"
-
-        print("Parsing", player)
-        response = requests.get(url)
-        if response.status_code == 200:
-            hist_made, hist_missed = process_response_dists(
-                response=response,
-                category="player"
-            )
-            np.savez(f"data/{player}/dists", hist_made[0], hist_made[1])
-            np.savez(f"data/{player}/dists_missed", hist_missed[0], hist_missed[1])
+def parse_team_shots(season, refresh=False, offline=False):
+    # Schedules are always fetched since games are added during the season,
+    # box scores already in the manifest are skipped unless refresh is set
+    manifest = load_manifest(season)
+
+    teams = teams_east + teams_west
+    schedules = fetch_team_schedules(season, teams, offline=offline)
+
+    jobs = []
+    for team, response in zip(teams, schedules):
+        if response is None or response.status_code != 200:
+            continue
+
+        print("Parsing matches for", team)
+        for match_id in parse_schedule(response):
+            job = {
+                "category": "match",
+                "team": team,
+                "player": "",
+                "match_id": match_id,
+            }
+            if refresh or not is_done(manifest, job_key(job)):
+                jobs.append((job, match_url(match_id)))
+
+    crawl_pages(season, manifest, jobs, offline=offline)
+
 
+def parse_players(season, refresh=False, offline=False):
+    # Player pages grow during the season, so with refresh every page is
+    # fetched again but only parsed if its content changed
+    manifest = load_manifest(season)
 
-def parse_team_shot_distances(season):
+    jobs = []
+    for player in players:
+        job = {
+            "category": "player",
+            "team": "",
+            "player": player,
+            "match_id": "",
+        }
+        if refresh or not is_done(manifest, job_key(job)):
+            jobs.append((job, player_url(season, player)))
+
+    def changed(job, response):
+        key = job_key(job)
+        return offline or not (
+            is_done(manifest, key)
+            and manifest[key]["hash"] == content_hash(response)
+        )
+
+    crawl_pages(season, manifest, jobs, accept=changed, offline=offline)
 
-    # TODO: This is only temporary bcs the scraping is bugging
-    for team in ["MEM"]:
-        url = f"{base_url}/teams/{team}/{season}_games.html"
-        response = requests.get(url)
-        if response.status_code == 200:
-            parse_matches(response, team, option="dists")
 
-        for _ in tqdm(range(0, 60), desc="Request cooldown (60s)"):
-            time.sleep(1)
-    print("Done!")
+def reparse_season(season):
+    # Parses every cached page of the season again without any request,
+    # e.g. after the parser changed
+    parse_team_shots(season, refresh=True, offline=True)
+    parse_players(season, refresh=True, offline=True)
 
 
 if __name__ == "__main__":
-    parse_team_shot_distances("2024")
+    parser = argparse.ArgumentParser(
+        description="Scrape the shots of a season from Basketball-Reference"
+    )
+    parser.add_argument("season", nargs="?", default="2024")
+    parser.add_argument("--refresh", action="store_true")
+    parser.add_argument("--reparse", action="store_true")
+    args = parser.parse_args()
+
+    if args.reparse:
+        reparse_season(args.season)
+    else:
+        parse_team_shots(args.season, refresh=args.refresh)
+        parse_players(args.season, refresh=args.refresh)
@@ -0,0 +1,307 @@
+import os
+
+import numpy as np
+
+from utils import teams_east, teams_west, players
+
+data_dir = "data"
+
+# The per-game .npz files in data/<TEAM>/ and data/<PLAYER>/ were scraped
+# before the store existed and all belong to the 2023-24 season
+legacy_season = "2024"
+
+# One row per shot. Team shots come from the box score shot charts and have
+# no player, player shots come from the player shooting pages and have no
+# team or match. The shooter is the UTF-8 encoded name from the tooltip of
+# team shots.
+shot_dtype = np.dtype([
+    ("team", "S3"),
+    ("player", "S9"),
+    ("match_id", "S12"),
+    ("x", "i2"),
+    ("y", "i2"),
+    ("made", "?"),
+    ("distance", "i1"),
+    ("shooter", "S32"),
+])
+
+# Pseudo entity for the aggregate of all teams
+LEAGUE = "league"
+
+# Position of the rim in shot chart pixels, 10px are one foot. The charts
+# of the player shooting pages put the rim 20px further down than the box
+# score charts.
+RIM_X, RIM_Y = 240, 30
+PLAYER_RIM_Y = 50
+PX_PER_FT = 10
+
+
+# Everything derived for a season lives in its own partition data/<season>/,
+# so requests for one season never touch the files of the others
+def season_dir(season):
+    return f"{data_dir}/{season}"
+
+
+def store_path(season):
+    return f"{season_dir(season)}/shots.npy"
+
+
+def available_seasons():
+    seasons = {legacy_season}
+    for entry in os.scandir(data_dir):
+        if entry.is_dir() and entry.name.isdigit():
+            seasons.add(entry.name)
+
+    return sorted(seasons, reverse=True)
+
+
+def season_label(season):
+    # Seasons are named by the year they end in, like on Basketball-Reference
+    return f"{int(season) - 1}-{season[-2:]}"
+
+
+def rim_y(player):
+    # player tells per shot whether it comes from a player shooting page
+    return np.where(player, PLAYER_RIM_Y, RIM_Y)
+
+
+def box_score_y(shots):
+    # y of the shots on the box score charts. Shots of the player pages are
+    # moved up onto the rim of the box score charts, so grids of teams and
+    # players line up.
+    return shots["y"] - (rim_y(shots["player"] != b"") - RIM_Y)
+
+
+def shot_distance(x, y, player=False):
+    return np.rint(np.hypot(x - RIM_X, y - rim_y(player)) / PX_PER_FT)
+
+
+def make_shots(x, y, made, team="", player="", match_id="", distance=None,
+               shooter=""):
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    shots = np.zeros(len(x), dtype=shot_dtype)
+    shots["team"] = team
+    shots["player"] = player
+    shots["match_id"] = match_id
+    shots["x"] = x
+    shots["y"] = y
+    shots["made"] = made
+    shots["distance"] = (
+        shot_distance(x, y, player != "") if distance is None else distance
+    )
+    if isinstance(shooter, str):
+        shots["shooter"] = shooter.encode()
+    else:
+        shots["shooter"] = [name.encode() for name in shooter]
+
+    return shots
+
+
+def team_rim_distances(shots):
+    # Stores built before the rim of the player charts was told apart have
+    # the distances of the legacy player shots measured from the box score
+    # rim
+    if "distance" not in shots.dtype.names:
+        return False
+
+    player = shots["player"] != b""
+    return bool(player.any()) and np.array_equal(
+        shots["distance"][player],
+        shot_distance(shots["x"][player], shots["y"][player])
+    )
+
+
+def migrate_store(shots):
+    # Stores written before a column was added get it zero-filled
+    migrated = np.zeros(len(shots), dtype=shot_dtype)
+    for name in shots.dtype.names:
+        if name in shot_dtype.names:
+            migrated[name] = shots[name]
+
+    if team_rim_distances(migrated):
+        player = migrated["player"] != b""
+        migrated["distance"][player] = shot_distance(
+            migrated["x"][player], migrated["y"][player], player=True
+        )
+
+    return migrated
+
+
+def read_legacy_file(path, made, **kwargs):
+    data = np.load(path)
+    return make_shots(data["arr_0"], data["arr_1"], made, **kwargs)
+
+
+def shots_from_legacy(path=data_dir):
+    # Collects the per-game made_<match_id>.npz/missed_<match_id>.npz files
+    # of the teams and the per-season made.npz/missed.npz files of the players
+    chunks = []
+    for team in teams_east + teams_west:
+        team_path = f"{path}/{team}"
+        if not os.path.isdir(team_path):
+            continue
+
+        for name in sorted(os.listdir(team_path)):
+            stem, ext = os.path.splitext(name)
+            if ext != ".npz" or stem.startswith("dists"):
+                continue
+
+            outcome, match_id = stem.split("_", 1)
+            chunks.append(read_legacy_file(
+                f"{team_path}/{name}",
+                made=outcome == "made",
+                team=team,
+                match_id=match_id
+            ))
+
+    for player in players:
+        for outcome in ["made", "missed"]:
+            player_path = f"{path}/{player}/{outcome}.npz"
+            if os.path.exists(player_path):
+                chunks.append(read_legacy_file(
+                    player_path,
+                    made=outcome == "made",
+                    player=player
+                ))
+
+    if not chunks:
+        return np.zeros(0, dtype=shot_dtype)
+
+    return np.concatenate(chunks)
+
+
+def entity_keys(shots):
+    # Player shots are keyed by player, team shots by team
+    return np.where(shots["player"] != b"", shots["player"], shots["team"])
+
+
+def write_store(shots, season):
+    os.makedirs(season_dir(season), exist_ok=True)
+
+    # Rows are sorted by entity, made shots come before missed shots and
+    # both are ordered by game, so every team, player, shot type and run of
+    # consecutive games is a contiguous slice of the file
+    shots = shots[np.lexsort(
+        (shots["match_id"], ~shots["made"], entity_keys(shots))
+    )]
+
+    # Write to a temporary file first so readers never see a partial store.
+    # Every process has its own, as several workers may build or migrate
+    # the store at the same time on first load.
+    path = store_path(season)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, shots)
+    os.replace(tmp_path, path)
+
+
+def is_sorted(shots):
+    # Stores written before the rows were ordered by game are sorted again
+    keys = entity_keys(shots)
+    same_entity = keys[1:] == keys[:-1]
+    same_made = same_entity & (shots["made"][1:] == shots["made"][:-1])
+    return bool(
+        np.all(keys[1:] >= keys[:-1])
+        and np.all(~same_entity | (shots["made"][1:] <= shots["made"][:-1]))
+        and np.all(~same_made
+                   | (shots["match_id"][1:] >= shots["match_id"][:-1]))
+    )
+
+
+def build_index(shots):
+    keys = entity_keys(shots)
+    entities, starts, counts = np.unique(
+        keys, return_index=True, return_counts=True
+    )
+    made = np.add.reduceat(shots["made"].astype(np.int64), starts) \
+        if len(starts) else starts
+
+    return {
+        entity.decode(): (start, start + n_made, start + count)
+        for entity, start, n_made, count in zip(
+            entities, starts.tolist(), made.tolist(), counts.tolist()
+        )
+    }
+
+
+# Open stores per season as (mtime, memory-mapped shots, offsets index).
+# Worker processes map the same file, so they all share the page cache.
+_stores = {}
+
+
+def open_store(season):
+    path = store_path(season)
+    if not os.path.exists(path):
+        if season != legacy_season:
+            shots = np.zeros(0, dtype=shot_dtype)
+            return shots, build_index(shots)
+        write_store(shots_from_legacy(), season)
+
+    # update_store replaces the file, so a new mtime means a new store
+    mtime = os.stat(path).st_mtime_ns
+    cached = _stores.get(season)
+    if cached is None or cached[0] != mtime:
+        shots = np.load(path, mmap_mode="r")
+        if (shots.dtype != shot_dtype or not is_sorted(shots)
+                or team_rim_distances(shots)):
+            write_store(migrate_store(shots), season)
+            mtime = os.stat(path).st_mtime_ns
+            shots = np.load(path, mmap_mode="r")
+
+        cached = (mtime, shots, build_index(shots))
+        _stores[season] = cached
+
+    return cached[1], cached[2]
+
+
+def store_version(season):
+    # Changes whenever the store of the season is rewritten
+    open_store(season)
+    return _stores[season][0] if season in _stores else 0
+
+
+def load_store(season):
+    return open_store(season)[0]
+
+
+def entity_mask(shots, entity):
+    if entity in teams_east + teams_west:
+        return (shots["team"] == entity.encode()) & (shots["player"] == b"")
+    else:
+        return shots["player"] == entity.encode()
+
+
+def update_store(season, shots, entity, match_ids=None):
+    # Replaces all rows of the given team or player with the new shots, or
+    # only the rows of the given matches
+    current = load_store(season)
+    mask = entity_mask(current, entity)
+    if match_ids is not None:
+        mask &= np.isin(current["match_id"], np.array(match_ids, dtype="S12"))
+    current = current[~mask]
+
+    write_store(np.concatenate([current, shots]), season)
+
+
+def select_shots(season, entity, shot_type="all"):
+    # Returns a view into the memory-mapped store, nothing is copied. Only
+    # the league is a copy of the slices of all teams.
+    if entity == LEAGUE:
+        return np.concatenate([
+            select_shots(season, team, shot_type)
+            for team in teams_east + teams_west
+        ])
+
+    shots, index = open_store(season)
+    if entity not in index:
+        return shots[:0]
+
+    start, split, stop = index[entity]
+    if shot_type == "made":
+        return shots[start:split]
+    elif shot_type == "missed":
+        return shots[split:stop]
+    else:
+        return shots[start:stop]
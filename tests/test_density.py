@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+import pytest
+
+from density import compute_density_fft, compute_density_sklearn, kernels
+from store import entity_keys, shots_from_legacy
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+GRID_SIZE = 100
+BANDWIDTH = 30
+
+# Largest difference to sklearn relative to the peak of the density. The
+# binning moves shots by up to half a grid cell, which the discontinuous
+# edge of the tophat kernel turns into much larger differences.
+TOLERANCE = {"tophat": 0.15}
+DEFAULT_TOLERANCE = 0.02
+
+
+@pytest.fixture(scope="module")
+def legacy_shots():
+    return shots_from_legacy(DATA_DIR)
+
+
+@pytest.mark.parametrize("kernel", list(kernels))
+@pytest.mark.parametrize("entity", ["GSW", "curryst01"])
+def test_fft_matches_sklearn(legacy_shots, entity, kernel):
+    shots = legacy_shots[entity_keys(legacy_shots) == entity.encode()]
+    assert len(shots)
+
+    args = (shots["x"], shots["y"], kernel, BANDWIDTH, GRID_SIZE)
+    fft = compute_density_fft(*args)
+    reference = compute_density_sklearn(*args)
+
+    error = np.abs(fft - reference).max() / reference.max()
+    assert error < TOLERANCE.get(kernel, DEFAULT_TOLERANCE)
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fetch import TokenBucket, fetch_pages
+from pagecache import PageCache
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+class StandIn(BaseHTTPRequestHandler):
+    # Answers every path with the next of its scripted responses, the last
+    # one repeats. A response of 304 is only sent to conditional requests.
+    routes = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, dict(self.headers)))
+        script = self.routes[self.path]
+        status, headers, body = script.pop(0) if len(script) > 1 \
+            else script[0]
+
+        if status == 304 and "If-None-Match" not in self.headers:
+            status = 200
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status == 304:
+            self.end_headers()
+            return
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandIn.routes = {}
+    StandIn.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(urls, cache_dir, **kwargs):
+    return fetch_pages(
+        urls, limiter=TokenBucket(1000, 10), cache=PageCache(cache_dir),
+        **kwargs
+    )
+
+
+def test_retries_on_429_and_503(server, tmp_path):
+    page = read_fixture("boxscore_202310250NYK.html")
+    StandIn.routes["/boxscore"] = [
+        (503, {"Retry-After": "0"}, b"unavailable"),
+        (429, {"Retry-After": "0"}, b"slow down"),
+        (200, {}, page),
+    ]
+
+    [response] = fetch([f"{server}/boxscore"], tmp_path)
+
+    assert response.status_code == 200
+    assert response.content == page
+    assert len(StandIn.requests) == 3
+
+
+def test_gives_up_after_retries(server, tmp_path):
+    StandIn.routes["/down"] = [(503, {"Retry-After": "0"}, b"unavailable")]
+
+    [response] = fetch([f"{server}/down"], tmp_path, retries=2)
+
+    assert response.status_code == 503
+    assert len(StandIn.requests) == 3
+
+
+def test_429_waits_for_retry_after(server, tmp_path):
+    page = read_fixture("player_tatumja01_2024.html")
+    StandIn.routes["/player"] = [
+        (429, {"Retry-After": "1"}, b"slow down"),
+        (200, {}, page),
+    ]
+
+    start = time.monotonic()
+    [response] = fetch([f"{server}/player"], tmp_path)
+
+    assert response.content == page
+    assert time.monotonic() - start >= 0.9
+
+
+def test_304_served_from_cache(server, tmp_path):
+    page = read_fixture("boxscore_202310250NYK.html")
+    StandIn.routes["/boxscore"] = [(304, {"ETag": '"v1"'}, page)]
+    url = f"{server}/boxscore"
+
+    [first] = fetch([url], tmp_path)
+    [second] = fetch([url], tmp_path)
+
+    assert first.status_code == second.status_code == 200
+    assert second.content == page
+    assert StandIn.requests[1][1]["If-None-Match"] == '"v1"'
+    assert fetch([url], tmp_path, offline=True)[0].content == page
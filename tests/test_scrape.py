@@ -0,0 +1,67 @@
+import os
+import re
+
+import numpy as np
+import pytest
+from bs4 import BeautifulSoup
+
+from scrape import parse_shots
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def reference_shots(html, category, team=""):
+    # The BeautifulSoup extraction of process_response and
+    # process_response_dists before the streaming parser. Box scores are
+    # searched for the chart of the team rather than the first chart.
+    if category == "match":
+        soup = BeautifulSoup(html, "html.parser")
+        shot_chart = soup.find("div", {"id": f"shots-{team}"})
+    else:
+        soup = BeautifulSoup(re.sub("<!--|-->", "", html), "html.parser")
+        shot_chart = soup.find_all("div", {"class": "shot-area"})[0]
+
+    r = re.compile(r"^tooltip")
+    points = shot_chart.find_all("div", {"class": r})
+
+    shots = {"x": [], "y": [], "made": [], "distance": [], "shooter": []}
+    for point in points:
+        style = point["style"]
+        x_px, y_px = style.split(";")[1], style.split(";")[0]
+        shots["x"].append(int(x_px.split(":")[-1].strip("px")))
+        shots["y"].append(int(y_px.split(":")[-1].strip("px")))
+
+        made = "make" in point["class"]
+        shots["made"].append(made)
+
+        if category == "player":
+            message = point["tip"].split("<br>")[2]
+            shooter = ""
+        else:
+            message = point["tip"].split("<br>")[1]
+            shooter = message.split(" made " if made else " missed ")[0]
+        shots["distance"].append(int(message.split(" ")[-2]))
+        shots["shooter"].append(shooter)
+
+    return shots
+
+
+@pytest.mark.parametrize("name, category, team", [
+    ("boxscore_202310250NYK.html", "match", "BOS"),
+    ("boxscore_202310250NYK.html", "match", "NYK"),
+    ("player_tatumja01_2024.html", "player", ""),
+])
+def test_parse_shots_matches_beautifulsoup(name, category, team):
+    html = read_fixture(name)
+    reference = reference_shots(html, category, team)
+    assert reference["x"]
+
+    shots = parse_shots(html, category, team=team, match_id="202310250NYK")
+    for field in ["x", "y", "made", "distance"]:
+        np.testing.assert_array_equal(shots[field], reference[field])
+    assert [s.decode() for s in shots["shooter"]] == reference["shooter"]
@@ -0,0 +1,175 @@
+from functools import lru_cache
+
+import numpy as np
+
+import metrics
+from density import grid_positions
+from games import game_shots
+from store import (
+    LEAGUE, RIM_X, RIM_Y, PX_PER_FT, open_store, rim_y, store_version
+)
+from utils import teams_east, teams_west
+
+# Court zones in shot chart pixels around the rim of the box score charts.
+# Left and right are as seen on the shot chart, the rim is at the top.
+zones = [
+    "restricted_area",
+    "paint",
+    "mid_range_left",
+    "mid_range_right",
+    "corner_3_left",
+    "corner_3_right",
+    "above_break_3",
+]
+zone_labels = {
+    "restricted_area": "Restricted Area",
+    "paint": "Paint",
+    "mid_range_left": "Mid-Range Left",
+    "mid_range_right": "Mid-Range Right",
+    "corner_3_left": "Left Corner 3",
+    "corner_3_right": "Right Corner 3",
+    "above_break_3": "Above the Break 3",
+}
+ZONES = len(zones)
+
+# NBA court markings relative to the rim, which is 5.25 ft off the baseline
+RESTRICTED_RADIUS = 4 * PX_PER_FT
+LANE_HALF_WIDTH = 8 * PX_PER_FT
+LANE_LENGTH = (19 - 5.25) * PX_PER_FT
+THREE_RADIUS = 23.75 * PX_PER_FT
+CORNER_THREE = 22 * PX_PER_FT
+# Where the straight corner lines meet the arc
+CORNER_LENGTH = np.sqrt(THREE_RADIUS ** 2 - CORNER_THREE ** 2)
+
+# Extent of the lookup raster, one cell per pixel. Shots outside are looked
+# up at the nearest edge, which is in the same zone.
+RASTER_X = (-60, 540)
+RASTER_Y = (-60, 940)
+
+
+def classify(x, y):
+    # Zone index of every position, from the court geometry
+    dx = np.asarray(x, dtype=float) - RIM_X
+    dy = np.asarray(y, dtype=float) - RIM_Y
+    r = np.hypot(dx, dy)
+
+    corner = (np.abs(dx) >= CORNER_THREE) & (dy <= CORNER_LENGTH)
+    three = corner | ((dy > CORNER_LENGTH) & (r >= THREE_RADIUS))
+    paint = (np.abs(dx) <= LANE_HALF_WIDTH) & (dy <= LANE_LENGTH)
+    left = dx < 0
+
+    zone = np.select(
+        [
+            r <= RESTRICTED_RADIUS,
+            paint,
+            ~three & left,
+            ~three,
+            corner & left,
+            corner,
+        ],
+        range(6),
+        default=zones.index("above_break_3")
+    )
+    return zone.astype(np.uint8)
+
+
+@lru_cache(maxsize=1)
+def zone_raster():
+    X, Y = np.meshgrid(np.arange(*RASTER_X), np.arange(*RASTER_Y))
+    raster = classify(X, Y)
+    raster.setflags(write=False)
+    return raster
+
+
+def shot_zones(x, y, player=False):
+    # Looks the zones of integer pixel positions up in the raster. Shots of
+    # the player pages are moved onto the rim of the box score charts.
+    raster = zone_raster()
+    y = np.asarray(y, dtype=np.intp) - (rim_y(player) - RIM_Y)
+    ix = np.clip(np.asarray(x, dtype=np.intp) - RASTER_X[0],
+                 0, raster.shape[1] - 1)
+    iy = np.clip(y - RASTER_Y[0], 0, raster.shape[0] - 1)
+    return raster[iy, ix]
+
+
+@lru_cache(maxsize=4)
+def zone_grid(grid_size):
+    # Zone of every point of the density grid, for drawing the zones
+    positions = grid_positions(grid_size)
+    grid = classify(positions[:, 0], positions[:, 1])
+    grid = grid.reshape(grid_size, grid_size)
+    grid.setflags(write=False)
+    return grid
+
+
+def zone_counts(shots):
+    # Row 0 counts the made shots per zone, row 1 the missed ones, like
+    # distance_counts
+    key = np.where(shots["made"], 0, ZONES) + shot_zones(
+        shots["x"], shots["y"], shots["player"] != b""
+    )
+    return np.bincount(key, minlength=2 * ZONES).reshape(2, ZONES)
+
+
+@lru_cache(maxsize=1024)
+def _zone_distribution(season, entity, last, start, end, opponent, version):
+    metrics.inc("heatshot_cache_misses_total", cache="zones")
+    with metrics.timer("heatshot_stage_seconds", stage="load"):
+        shots = game_shots(
+            season, entity, last=last, start=start, end=end,
+            opponent=opponent
+        )
+    with metrics.timer("heatshot_stage_seconds", stage="zones"):
+        counts = zone_counts(shots)
+    counts.setflags(write=False)
+    return counts
+
+
+def zone_distribution(season, entity, last=None, start=None, end=None,
+                      opponent=None):
+    # Made and missed counts per zone of the shots of the selected games
+    if entity == LEAGUE and (last, start, end, opponent) == (None,) * 4:
+        # The whole season of the league is the sum over the teams
+        return season_zones(season).sum(axis=0)
+
+    metrics.inc("heatshot_cache_lookups_total", cache="zones")
+    return _zone_distribution(
+        season, entity, last, start, end, opponent, store_version(season)
+    )
+
+
+def team_zone_counts(shots, index):
+    # Counts of all teams at once, shape (teams, 2, ZONES) in the order of
+    # teams_east + teams_west. The team shots are one block of the store
+    # per team, so a single bincount over them is enough.
+    teams = [team for team in teams_east + teams_west if team in index]
+    counts = np.zeros((len(teams_east + teams_west), 2, ZONES), dtype=int)
+    if not teams:
+        return counts
+
+    blocks = [index[team] for team in teams]
+    rows = np.concatenate([np.arange(a, c) for a, _, c in blocks])
+    team_of_row = np.repeat(
+        [(teams_east + teams_west).index(team) for team in teams],
+        [c - a for a, _, c in blocks]
+    )
+    key = (
+        team_of_row * 2 * ZONES
+        + np.where(shots["made"][rows], 0, ZONES)
+        + shot_zones(shots["x"][rows], shots["y"][rows])
+    )
+    return np.bincount(key, minlength=counts.size).reshape(counts.shape)
+
+
+@lru_cache(maxsize=16)
+def _season_zones(season, version):
+    metrics.inc("heatshot_cache_misses_total", cache="zones")
+    with metrics.timer("heatshot_stage_seconds", stage="zones"):
+        counts = team_zone_counts(*open_store(season))
+    counts.setflags(write=False)
+    return counts
+
+
+def season_zones(season):
+    metrics.inc("heatshot_cache_lookups_total", cache="zones")
+    return _season_zones(season, store_version(season))